@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+from abc import ABC, abstractmethod
+from os import path
+
+# 耗时的分桶，秒
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+# 数据行数的分桶
+ROWS_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+# 每个委托读取文件次数的分桶
+POLLS_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+
+# 全部指标，按创建顺序输出
+_metrics = []
+# 输出指标之前调用的函数，用于更新从其它模块的统计数据得到的指标
+_collectors = []
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def _format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _Metric(ABC):
+    """按标签值分组的指标，标签值以位置参数传入labels()"""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    @abstractmethod
+    def _new_child(self):
+        """创建一组标签值对应的数据"""
+
+    @abstractmethod
+    def _samples(self, values: tuple, child) -> list:
+        """一组标签值的输出数据行"""
+
+    def render(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for values, child in list(self._children.items()):
+            lines.extend(self._samples(values, child))
+        return lines
+
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """只增不减的计数"""
+
+    type = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def _samples(self, values: tuple, child) -> list:
+        labels = _format_labels(self.labelnames, values)
+        return [f"{self.name}_total{labels} {_format_value(child.value)}"]
+
+
+class Gauge(_Metric):
+    """可以任意设置的数值"""
+
+    type = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def _samples(self, values: tuple, child) -> list:
+        labels = _format_labels(self.labelnames, values)
+        return [f"{self.name}{labels} {_format_value(child.value)}"]
+
+
+class _HistogramValue:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+
+class Histogram(_Metric):
+    """分桶统计，输出累计的桶计数、总和与次数"""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        self.buckets = tuple(buckets)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def _samples(self, values: tuple, child) -> list:
+        names = self.labelnames + ("le",)
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, child.counts):
+            cumulative += count
+            labels = _format_labels(names, values + (_format_value(bound),))
+            samples.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(names, values + ("+Inf",))
+        samples.append(f"{self.name}_bucket{labels} {child.count}")
+
+        labels = _format_labels(self.labelnames, values)
+        samples.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        samples.append(f"{self.name}_count{labels} {child.count}")
+        return samples
+
+
+def add_collector(func):
+    """注册输出指标之前调用的函数"""
+    _collectors.append(func)
+
+
+def render_metrics() -> str:
+    """以Prometheus文本格式输出全部指标"""
+    for collect in _collectors:
+        collect()
+
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ------------------------------ 指标定义 ------------------------------
+
+http_request_seconds = Histogram(
+    "gmadaptor_http_request_seconds",
+    "HTTP request latency in seconds",
+    ("endpoint", "account", "status"),
+)
+
+csv_parse_seconds = Histogram(
+    "gmadaptor_csv_parse_seconds",
+    "Time spent reading and parsing a GM output file in seconds",
+    ("account", "file"),
+)
+
+csv_parse_rows = Histogram(
+    "gmadaptor_csv_parse_rows",
+    "Rows parsed per read of a GM output file",
+    ("account", "file"),
+    ROWS_BUCKETS,
+)
+
+order_polls = Histogram(
+    "gmadaptor_order_polls",
+    "Status file reads from order write to terminal status",
+    ("account",),
+    POLLS_BUCKETS,
+)
+
+order_first_status_seconds = Histogram(
+    "gmadaptor_order_first_status_seconds",
+    "Time from order write to its first row in order_status_change.csv",
+    ("account",),
+)
+
+order_terminal_status_seconds = Histogram(
+    "gmadaptor_order_terminal_status_seconds",
+    "Time from order write to its terminal status",
+    ("account",),
+)
+
+order_write_ack_seconds = Histogram(
+    "gmadaptor_order_write_ack_seconds",
+    "Time from order submission to input file written",
+    ("account",),
+)
+
+order_writer_stats = Gauge(
+    "gmadaptor_order_writer_stats",
+    "Cumulative stats of the order file writer",
+    ("account", "stat"),
+)
+
+order_wait_timeouts = Counter(
+    "gmadaptor_order_wait_timeouts",
+    "Order waits that ended at the deadline before the orders finished",
+    ("account", "mode"),
+)
+
+
+def observe_csv_parse(filename: str, seconds: float, rows: int):
+    """记录一次GM输出文件的读取，账户和文件名从路径中取出（gm_output/账户/文件名）"""
+    account = path.basename(path.dirname(filename))
+    name = path.basename(filename)
+    csv_parse_seconds.labels(account, name).observe(seconds)
+    csv_parse_rows.labels(account, name).observe(rows)
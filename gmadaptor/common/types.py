@@ -88,6 +88,24 @@ class TradeOrder:
 
 class TradeEvent:
     # 委托结果，包括了成功和失败的集合
+    __slots__ = (
+        "code",
+        "price",
+        "volume",
+        "order_side",
+        "bid_type",
+        "created_at",
+        "entrust_no",
+        "status",
+        "avg_price",
+        "filled",
+        "order_id",
+        "reason",
+        "trade_fees",
+        "recv_at",
+        "filled_amount",
+        "invalid",
+    )
 
     def __init__(
         self,
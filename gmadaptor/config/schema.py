@@ -31,11 +31,31 @@ class Config(object):
 
         access_token: Optional[str] = None
 
+        workers: Optional[int] = None
+
+        shard_by_account: Optional[bool] = None
+
     class gm_info:
         fake: Optional[bool] = None
 
         gm_output: Optional[str] = None
 
+        file_watcher: Optional[str] = None
+
+        file_poll_interval: Optional[int] = None
+
+        file_poll_busy_interval: Optional[int] = None
+
+        order_write_window: Optional[int] = None
+
+        order_file_idle_close: Optional[int] = None
+
+        order_durability: Optional[str] = None
+
+        group_fsync_interval: Optional[int] = None
+
+        order_trace_size: Optional[int] = None
+
         class trade_fees:
             commission: Optional[float] = None
 
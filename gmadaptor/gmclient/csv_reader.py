@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import csv
+import io
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from gmadaptor.common.metrics import observe_csv_parse
+
+logger = logging.getLogger(__name__)
+
+_BOM = b"\xef\xbb\xbf"
+
+# 读写CSV文件的线程池，文件操作不在事件循环中执行，避免阻塞其它请求
+_io_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="csv_io")
+
+
+async def run_in_io_executor(func, *args):
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_io_executor, func, *args)
+
+
+class CSVTailReader:
+    """CSV文件增量读取器
+
+    掘金输出的状态变化、执行回报等文件只会在末尾追加数据，读取器记录上次读取的
+    字节位置和表头，每次只解析新追加的完整数据行。最后一行如果尚未写完（没有换行符），
+    留待下次读取。文件被截断（长度变小）、被替换（inode变化），或者已读取部分的最后
+    几个字节发生了变化（原地改写）时，从头重新读取。
+    """
+
+    filename: str  # 读取的文件
+    header: list  # 表头字段
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.reset()
+
+    def reset(self):
+        self.header = None
+        self._offset = 0
+        self._inode = None
+        self._mtime = None
+        self._tail = b""  # 已读取部分的最后若干字节，用于判断文件是否被改写
+
+    def read_rows(self):
+        """读取上次读取之后新追加的数据行
+
+        Returns:
+            tuple: (rows, restarted)，rows为csv.reader读出的数据行（字段列表），字段的
+                含义见header；restarted表示文件被截断或者替换，本次是从头读取的，
+                调用者需要丢弃之前读取的数据
+        """
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return [], False
+
+        restarted = False
+        if self._inode is not None and (
+            stat.st_ino != self._inode or stat.st_size < self._offset
+        ):
+            logger.info(
+                "file truncated or replaced, read from start: %s", self.filename
+            )
+            self.reset()
+            restarted = True
+
+        if stat.st_size == self._offset and stat.st_mtime_ns == self._mtime:
+            return [], restarted
+        self._inode = stat.st_ino
+        self._mtime = stat.st_mtime_ns
+
+        with open(self.filename, "rb") as f:
+            start = self._offset - len(self._tail)
+            f.seek(start)
+            data = f.read(stat.st_size - start)
+            if not data.startswith(self._tail):
+                logger.info("file rewritten, read from start: %s", self.filename)
+                self.reset()
+                self._inode = stat.st_ino
+                self._mtime = stat.st_mtime_ns
+                restarted = True
+                f.seek(0)
+                data = f.read(stat.st_size)
+            else:
+                data = data[len(self._tail) :]
+
+        # 只处理完整的行，未写完的部分留待下次
+        end = data.rfind(b"\n")
+        if end == -1:
+            return [], restarted
+        data = data[: end + 1]
+        self._tail = data[-64:]
+        if self._offset == 0 and data.startswith(_BOM):
+            data = data[len(_BOM) :]
+        self._offset += end + 1
+
+        rows = csv.reader(io.StringIO(data.decode("utf-8"), newline=""))
+        if self.header is None:
+            self.header = next(rows, None)
+            if self.header is None:
+                return [], restarted
+
+        return [row for row in rows if row], restarted
+
+
+class CSVSnapshotCache:
+    """按文件的(mtime, size, inode)缓存解析结果
+
+    资金、持仓等文件由掘金整体改写，文件没有变化时直接返回上次解析的结果，
+    只有文件被改写后才重新解析。解析失败（比如文件正在被改写，读不到数据）时，
+    返回上次有效的结果。
+    """
+
+    def __init__(self, loader, count_rows=len):
+        """
+        Args:
+            loader: 解析函数，参数为文件名，返回解析结果，无有效数据时返回None
+            count_rows: 计算解析结果中数据行数的函数，用于统计
+        """
+        self._loader = loader
+        self._count_rows = count_rows
+        self._snapshots = {}  # filename -> (key, data)
+
+    def get(self, filename: str):
+        stat = os.stat(filename)
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+        snapshot = self._snapshots.get(filename)
+        if snapshot is not None and snapshot[0] == key:
+            return snapshot[1]
+
+        t0 = time.perf_counter()
+        data = self._loader(filename)
+        if data is None:
+            return None if snapshot is None else snapshot[1]
+        observe_csv_parse(filename, time.perf_counter() - t0, self._count_rows(data))
+
+        self._snapshots[filename] = (key, data)
+        return data
@@ -4,16 +4,22 @@
 import csv
 import datetime
 import logging
+import os
+import time
 from os import path
-from threading import Lock
 
+from gmadaptor.common.metrics import observe_csv_parse
 from gmadaptor.common.utils import stockcode_to_myquant
-from gmadaptor.gmclient.csvdata import GMExecReport, GMOrderReport
+from gmadaptor.gmclient.csv_reader import CSVSnapshotCache, run_in_io_executor
+from gmadaptor.gmclient.csvdata import GMExecReport, GMOrderReport, csv_record_parser
+from gmadaptor.gmclient.order_index import get_order_index
+from gmadaptor.gmclient.order_trace import (
+    trace_cancels_written,
+    trace_orders_written,
+)
+from gmadaptor.gmclient.order_writer import get_order_writer
 from gmadaptor.gmclient.types import get_gm_order_side, get_gm_order_type
 from gmadaptor.gmclient.wrapper import (
-    get_gm_account_info,
-    get_gm_in_csv_cancelorder,
-    get_gm_in_csv_order,
     get_gm_out_csv_execreport,
     get_gm_out_csv_orderstatus,
 )
@@ -21,106 +27,153 @@ from gmadaptor.gmclient.wrapper import (
 logger = logging.getLogger(__name__)
 
 
-# -----------------------  generate order or cancel order -------------------------
-async def csv_generate_orders(account_id: str, trade_info_list: list):
-    # get account information
-    acct_info = get_gm_account_info(account_id)
-    if acct_info is None:
-        return None
+# csv_read_last_row解析过的表头：filename -> (inode, 读取时的文件长度, 表头行, 表头)
+_last_row_headers = {}
 
-    in_file = get_gm_in_csv_order(acct_info)
-    if in_file is None:
-        return None
 
-    # get lock object for this input file
-    lock = acct_info[2]
-    if lock is None:
-        logger.error(
-            "csv_generate_order: lock object for this account not found, %s", account_id
-        )
-        return None
+def _read_header(f, filename: str, stat: os.stat_result):
+    """取出文件的表头和数据开始的位置
 
-    order_added = {}
+    文件只追加数据（inode不变，长度没有变小），并且表头行的内容没有变化时，使用上次
+    解析的表头。
+    """
+    cached = _last_row_headers.get(filename)
+    if cached is not None and cached[0] == stat.st_ino and stat.st_size >= cached[1]:
+        header_line = f.read(len(cached[2]))
+        if header_line == cached[2]:
+            _last_row_headers[filename] = (stat.st_ino, stat.st_size) + cached[2:]
+            return cached[3], len(header_line)
+        f.seek(0)
 
-    try:
-        lock.acquire()
-
-        add_head = False
-        if not path.exists(in_file):
-            add_head = True
-
-        with open(in_file, "a+", encoding="utf-8-sig") as csvfile:
-            if add_head:
-                csvfile.write(
-                    "sid,account_id,symbol,volume,order_type,order_business(order_biz),price,comment\n"
-                )
-
-            for trade_info in trade_info_list:
-                security = trade_info["security"]
-                volume = trade_info["volume"]
-                price = trade_info["price"]
-                order_side = trade_info["order_side"]
-                order_type = trade_info["order_type"]
-                sid = trade_info["cid"]
-
-                _security = stockcode_to_myquant(security)
-                _order_type = get_gm_order_type(order_type)
-                _order_side = get_gm_order_side(order_side)
-
-                csvfile.write(
-                    f"{sid},{account_id},{_security},{volume},{_order_type},{_order_side},{price},\n"
-                )
-                order_added[sid] = trade_info
-            # save to disk immediately
-            csvfile.flush()
-    except Exception as e:
-        logger.warning("csv_generate_order: %s", e)
-    finally:
-        lock.release()
-
-    return order_added
+    header_line = f.readline()
+    if not header_line.endswith(b"\n"):
+        return None, 0
+    header = next(csv.reader([header_line.decode("utf-8-sig").rstrip("\r\n")]))
+    _last_row_headers[filename] = (stat.st_ino, stat.st_size, header_line, header)
+    return header, len(header_line)
 
 
-async def csv_generate_cancel_orders(account_id: str, sid_list: list):
-    # get account information
-    acct_info = get_gm_account_info(account_id)
-    if acct_info is None:
-        return -1
+def csv_read_last_row(filename: str, block_size: int = 4096):
+    """读取CSV文件的最后一条完整记录
 
-    in_file = get_gm_in_csv_cancelorder(acct_info)
-    if in_file is None:
-        return -1
+    表头只在第一次读取，或者文件被替换、表头变化时解析，之后从文件末尾向前读取，只解析
+    最后一条记录，读取的开销与文件的行数无关。最后一行没有换行符时，掘金终端可能还在
+    写入这一行（已经写入的部分字段数也可能与表头一致），视为尚未写完，返回前一条记录。
 
-    # get lock object for this input file
-    lock = acct_info[2]
-    if lock is None:
-        logger.error("lock object for this account not found: %s", account_id)
-        return -1
+    Args:
+        filename (str): 文件名，文件开头可以有BOM
+        block_size (int): 每次向前读取的字节数
+
+    Returns:
+        dict: 最后一条记录，没有数据时返回None
+    """
+    with open(filename, "rb") as f:
+        stat = os.fstat(f.fileno())
+        header, data_start = _read_header(f, filename, stat)
+        if header is None:
+            return None
+
+        pos = stat.st_size
+        buf = b""
+        while pos > data_start:
+            size = min(block_size, pos - data_start)
+            pos -= size
+            f.seek(pos)
+            buf = f.read(size) + buf
+
+            # 最后一个换行符之后的内容尚未写完
+            complete = buf[: buf.rfind(b"\n") + 1]
+
+            # 第一行如果不是从行首开始的，不完整
+            lines = complete.split(b"\n")[:-1]
+            if pos > data_start:
+                lines = lines[1:]
+
+            for line in reversed(lines):
+                line = line.rstrip(b"\r")
+                if line:
+                    row = next(csv.reader([line.decode("utf-8")]))
+                    return dict(zip(header, row))
+
+    return None
 
-    order_added = []
 
+# -----------------------  generate order or cancel order -------------------------
+def _order_line(account_id: str, trade_info: dict) -> str:
+    """生成文件单的一行，参数不合法时抛出异常"""
+    sid = trade_info["cid"]
+    volume = trade_info["volume"]
+    price = trade_info["price"]
+    security = trade_info["security"]
     try:
-        lock.acquire()
+        _security = stockcode_to_myquant(security)
+    except (AttributeError, ValueError):
+        raise ValueError(f"invalid security: {security}") from None
+    _order_type = get_gm_order_type(trade_info["order_type"])
+    _order_side = get_gm_order_side(trade_info["order_side"])
+
+    line = (
+        f"{sid},{account_id},{_security},{volume},{_order_type},{_order_side},{price},"
+    )
+    # 字段中的逗号和换行符会破坏文件单的格式
+    if line.count(",") != 7 or "\r" in line or "\n" in line:
+        raise ValueError("comma or line break in order fields")
+    return line + "\n"
+
+
+async def csv_generate_orders(account_id: str, trade_info_list: list):
+    """写入委托到文件单
+
+    Returns:
+        tuple: (order_added, order_failed)，order_added为写入的委托，sid -> trade_info；
+            order_failed为参数不合法、没有写入的委托，sid -> (trade_info, 原因)。
+            账户不存在时返回None
+    """
+    writer = get_order_writer(account_id)
+    if writer is None:
+        return None
+
+    order_added = {}
+    order_failed = {}
+    lines = []
+    for i, trade_info in enumerate(trade_info_list):
+        try:
+            lines.append(_order_line(account_id, trade_info))
+        except Exception as e:
+            # 一笔委托不合法不影响其它委托
+            logger.warning("csv_generate_order: %s, %s", e, trade_info)
+            if isinstance(e, KeyError):
+                reason = f"{e.args[0]} cannot be empty"
+            else:
+                reason = str(e) or type(e).__name__
+            sid = trade_info.get("cid") if isinstance(trade_info, dict) else None
+            order_failed[sid or str(i)] = (trade_info, reason)
+            continue
+        order_added[trade_info["cid"]] = trade_info
+
+    # 同一时间窗口内的委托合并写入，写入文件后才返回
+    if not lines or not await writer.write_orders(lines):
+        return {}, order_failed
+
+    index = get_order_index(account_id)
+    if index is not None:
+        index.track_orders(order_added.keys())
+    trace_orders_written(account_id, order_added.keys())
+    return order_added, order_failed
+
 
-        add_head = False
-        if not path.exists(in_file):
-            add_head = True
+async def csv_generate_cancel_orders(account_id: str, sid_list: list):
+    writer = get_order_writer(account_id)
+    if writer is None:
+        return -1
 
-        with open(in_file, "a+", encoding="utf-8-sig") as csvfile:
-            if add_head:
-                csvfile.write("sid,comment\n")
+    lines = [f"{sid},comments,\n" for sid in sid_list]
+    if not await writer.write_cancel_orders(lines):
+        return []
 
-            for sid in sid_list:
-                csvfile.write(f"{sid},comments,\n")
-                order_added.append(sid)
-            # save to disk immediately
-            csvfile.flush()
-    except Exception as e:
-        logger.warning("csv_generate_order: %s", e)
-    finally:
-        lock.release()
+    trace_cancels_written(account_id, sid_list)
 
-    return order_added
+    return list(sid_list)
 
 
 # ------------------  generate order or cancel order ------ end ----------------
@@ -133,12 +186,33 @@ async def csv_get_exec_report_data(account_id: str, sid_list: list):
         logger.error("execution report file not found: %s", exec_rpt_file)
         return None
 
+    return await run_in_io_executor(_read_exec_reports, exec_rpt_file, sid_list)
+
+
+def _read_exec_reports(exec_rpt_file: str, sid_list: list):
+    t0 = time.perf_counter()
     reports = {}
-    with open(exec_rpt_file, "r", encoding="utf-8-sig") as csvfile:
-        for row in csv.DictReader(csvfile):
-            report = GMExecReport(row)
+    rows_parsed = 0
+    with open(exec_rpt_file, "r", encoding="utf-8-sig", newline="") as csvfile:
+        rows = csv.reader(csvfile)
+        header = next(rows, None)
+        if header is None:
+            return reports
+
+        exec_ids = set()
+        parse = csv_record_parser(GMExecReport, header)
+        for row in rows:
+            if not row:
+                continue
+            report = parse(row)
+            rows_parsed += 1
             if report.exec_type != 15:  # 15成交，19执行有异常
                 continue
+            # 掘金可能重复输出同一笔回报
+            if report.exec_id:
+                if report.exec_id in exec_ids:
+                    continue
+                exec_ids.add(report.exec_id)
             # 跳过异常数据后，只保留有效数据
             if not sid_list:
                 if report.sid in reports:
@@ -153,56 +227,121 @@ async def csv_get_exec_report_data(account_id: str, sid_list: list):
                 else:
                     reports[report.sid] = [report]
 
+    observe_csv_parse(exec_rpt_file, time.perf_counter() - t0, rows_parsed)
     return reports
 
 
-async def csv_get_order_status_change_data_by_sidlist(status_file: str, sidlist: list):
-    result_reports = {}
-    with open(status_file, "r", encoding="utf-8-sig") as csvfile:
-        for row in csv.DictReader(csvfile):
-            report = GMOrderReport(row)
-            # 每次遍历所有数据，最后的总是最新的
-            if report.sid in sidlist:
-                result_reports[report.sid] = report
-
-    # retry next time until timeout
-    if len(result_reports) == 0:  # not found
-        return {"result": -1}
+# 委托状态文件中当天数据开始的位置：filename -> (offset, 前一行的内容)
+_order_status_day_offsets = {}
+
+
+def _load_order_status_rows(order_status_file: str):
+    """读取委托状态文件中当天的原始数据行，按sid索引，不解析字段
+
+    文件中的委托按创建时间排列，记录当天第一条委托的位置和它前面一行的内容，下次读取
+    时如果前一行没有变化，直接从这个位置开始读，跳过历史数据。包含当天日期的行才用
+    csv解析，再以created_at的前缀判断是否当天的委托，不解析时间。
+
+    Returns:
+        tuple: (header, rows)，rows为sid -> 数据行，文件为空时返回None
+    """
+    today = datetime.date.today().isoformat()
+    marker = today.encode()
+
+    with open(order_status_file, "rb") as f:
+        header_line = f.readline()
+        if not header_line.endswith(b"\n"):
+            return None
+        header = next(csv.reader([header_line.decode("utf-8-sig")]))
+        sid_pos = header.index("sid")
+        created_pos = header.index("created_at")
+
+        offset, prev_line = f.tell(), header_line
+        hint = _order_status_day_offsets.get(order_status_file)
+        if hint is not None and hint[0] > offset:
+            f.seek(hint[0] - len(hint[1]))
+            if f.read(len(hint[1])) == hint[1]:
+                offset, prev_line = hint
+            else:
+                logger.info("order status file rewritten: %s", order_status_file)
+        f.seek(offset)
+
+        day_start = None
+        rows_by_sid = {}
+        for line in f:
+            if not line.endswith(b"\n"):  # 尚未写完的行
+                break
+
+            if marker in line:
+                row = next(csv.reader([line.decode("utf-8")]))
+                if len(row) > created_pos and row[created_pos].startswith(today):
+                    if day_start is None:
+                        day_start = (offset, prev_line)
+                    # 按文件顺序，后面的记录覆盖前面的
+                    rows_by_sid[row[sid_pos]] = row
+
+            offset += len(line)
+            prev_line = line
+
+    # 当天还没有委托时，下次从文件末尾开始读
+    _order_status_day_offsets[order_status_file] = day_start or (offset, prev_line)
+    return header, rows_by_sid
+
+
+# 委托状态文件的数据行，文件没有变化时不再读取
+_order_status_rows = CSVSnapshotCache(
+    _load_order_status_rows, count_rows=lambda data: len(data[1])
+)
 
-    # 任何一个委托状态不确定时，返回结果等待下一次查询
-    for sid in result_reports.keys():
-        report = result_reports[sid]
-        # 执行完毕状态: 3已成, 5, 已撤, 8已拒, 9挂起, 12已过期
-        if report.status not in (3, 5, 8, 9, 12):
-            # need retry: 2部成, 10待报, 1已报，6待撤
-            return {"result": 1, "reports": result_reports}
 
-    return {"result": 0, "reports": result_reports}
+async def csv_get_order_status(account_id: str, sid_list: list = None):
+    """取出日内委托数据
 
+    Args:
+        account_id (str): 掘金交易账号ID
+        sid_list (list): 需要的委托，为空时取出所有日内委托
 
-async def csv_get_order_status(account_id: str):
-    # 取出所有日内委托数据
+    Returns:
+        list: GMOrderReport列表，文件不存在时返回None
+    """
     order_status_file = get_gm_out_csv_orderstatus(account_id)
     if not path.exists(order_status_file):
         logger.error("execution report file not found: %s", order_status_file)
         return None
 
+    return await run_in_io_executor(
+        _read_today_order_status, order_status_file, sid_list
+    )
+
+
+def _read_today_order_status(order_status_file: str, sid_list: list = None):
     today = datetime.datetime.now()
 
     orders = []
-    with open(order_status_file, "r", encoding="utf-8-sig") as csvfile:
-        for row in csv.DictReader(csvfile):
-            order = GMOrderReport(row)
-            ot = order.created_at
-            if (
-                ot.year == today.year
-                and ot.month == today.month
-                and ot.day == today.day
-            ):
-                logger.debug(
-                    f"read order status of today: {order.sid} -> {order.cl_ord_id}, status: {order.status}"
-                )
-                orders.append(order)
+    snapshot = _order_status_rows.get(order_status_file)
+    if snapshot is None:
+        return orders
+
+    header, rows_by_sid = snapshot
+    if sid_list:
+        # 只解析需要的委托
+        wanted = dict.fromkeys(sid_list)
+        rows = [rows_by_sid[sid] for sid in wanted if sid in rows_by_sid]
+    else:
+        rows = rows_by_sid.values()
+
+    parse = csv_record_parser(GMOrderReport, header)
+    for row in rows:
+        order = parse(row)
+        ot = order.created_at
+        if ot.year == today.year and ot.month == today.month and ot.day == today.day:
+            logger.debug(
+                "read order status of today: %s -> %s, status: %s",
+                order.sid,
+                order.cl_ord_id,
+                order.status,
+            )
+            orders.append(order)
 
     logger.debug("total orders read: %d", len(orders))
     return orders
@@ -2,6 +2,8 @@
 # @Author   : henry
 # @Time     : 2022-03-09 15:08
 import datetime
+from functools import lru_cache
+from operator import itemgetter
 
 from gmadaptor.common.utils import (
     math_round,
@@ -11,14 +13,62 @@ from gmadaptor.common.utils import (
 )
 
 
-def datetime_conversion(timestr: str):
-    # 2022-03-12T15:58:03.441803+08:00
+def _strptime_conversion(timestr: str):
     if timestr.find(".") != -1:
         return datetime.datetime.strptime(timestr, "%Y-%m-%dT%H:%M:%S.%f+08:00")
     else:
         return datetime.datetime.strptime(timestr, "%Y-%m-%dT%H:%M:%S+08:00")
 
 
+@lru_cache(maxsize=4096)
+def _seconds_conversion(timestr: str):
+    # 同一秒内的回报很多，缓存到秒的解析结果
+    return datetime.datetime.strptime(timestr, "%Y-%m-%dT%H:%M:%S")
+
+
+def datetime_conversion(timestr: str):
+    # 2022-03-12T15:58:03.441803+08:00
+    # 固定格式的时间直接切分，秒以上部分使用缓存，其它格式交给strptime处理
+    if len(timestr) >= 25 and timestr.endswith("+08:00"):
+        if len(timestr) == 25:
+            return _seconds_conversion(timestr[:19])
+
+        frac = timestr[20:-6]
+        if timestr[19] == "." and len(frac) <= 6 and frac.isascii() and frac.isdigit():
+            return _seconds_conversion(timestr[:19]).replace(
+                microsecond=int(frac.ljust(6, "0"))
+            )
+
+    return _strptime_conversion(timestr)
+
+
+@lru_cache(maxsize=64)
+def _compile_fields(fields: tuple, header: tuple):
+    return itemgetter(*[header.index(field) for field in fields])
+
+
+def csv_record_parser(record_type, header: list):
+    """按照表头编译出记录类型的解析函数
+
+    表头中字段的位置只计算一次，解析函数的参数为csv.reader读出的一行数据，
+    按照record_type.csv_fields的顺序取出字段，构建记录对象
+
+    Args:
+        record_type: GMOrderReport或者GMExecReport
+        header (list): CSV文件的表头
+
+    Returns:
+        解析函数，数据行缺少字段时抛出IndexError
+    """
+    getter = _compile_fields(record_type.csv_fields, tuple(header))
+    from_values = record_type.from_values
+
+    def parse(row: list):
+        return from_values(getter(row))
+
+    return parse
+
+
 class GMCash:
     account_id: str  # 掘金交易账号ID
     market_val: float  # 持仓市值
@@ -33,6 +83,18 @@ class GMCash:
     # recv_at: datetime.datetime  # 终端接收时间
     ord_frozen: float  # 冻结资金
 
+    __slots__ = (
+        "account_id",
+        "market_val",
+        "nav",
+        "pnl",
+        "fpnl",
+        "frozen",
+        "balance",
+        "available",
+        "ord_frozen",
+    )
+
     def __init__(self, dict_data):
         self.account_id = dict_data["account_id"]
         self.market_val = safe_float(dict_data["market_value(market_val)"])
@@ -82,6 +144,20 @@ class GMPosition:
     # updated_at: int # 仓位变更时间
     # recv_at: int    # 终端接收时间
 
+    __slots__ = (
+        "account_id",
+        "symbol",
+        "side",
+        "volume",
+        "vol_today",
+        "vwap",
+        "vwap_dild",
+        "market_val",
+        "price",
+        "fpnl",
+        "avl_now",
+    )
+
     def __init__(self, dict_data):
         self.account_id = dict_data["account_id"]
         self.symbol = dict_data["symbol"]
@@ -134,24 +210,79 @@ class GMOrderReport:
     # filledvwap: float   #已成均价    ---->  暂时没有此字段
     # filled_amt: float   #已成金额    ---->  暂时没有此字段
 
+    __slots__ = (
+        "sid",
+        "cl_ord_id",
+        "order_id",
+        "symbol",
+        "order_type",
+        "order_side",
+        "status",
+        "rej_reason",
+        "rej_detail",
+        "price",
+        "volume",
+        "filled_vol",
+        "created_at",
+        "recv_at",
+    )
+
     # account_id,sid,scan_name,cl_ord_id,order_id,symbol,order_type,order_business(order_biz),
     # status,ord_rej_reason(rej_reason),ord_rej_reason_detail(rej_detail),
     # price,volume,filled_volume(filled_vol),created_at,updated_at,sent_at,recv_at
+    csv_fields = (
+        "sid",
+        "cl_ord_id",
+        "order_id",
+        "symbol",
+        "order_type",
+        "order_business(order_biz)",
+        "status",
+        "ord_rej_reason(rej_reason)",
+        "ord_rej_reason_detail(rej_detail)",
+        "price",
+        "volume",
+        "filled_volume(filled_vol)",
+        "created_at",
+        "recv_at",
+    )
+
     def __init__(self, dict_data):
-        self.sid = dict_data["sid"]
-        self.cl_ord_id = dict_data["cl_ord_id"]
-        self.order_id = dict_data["order_id"]
-        self.symbol = dict_data["symbol"]
-        self.order_type = safe_int(dict_data["order_type"])
-        self.order_side = safe_int(dict_data["order_business(order_biz)"])
-        self.status = safe_int(dict_data["status"])
-        self.rej_reason = safe_int(dict_data["ord_rej_reason(rej_reason)"])
-        self.rej_detail = dict_data["ord_rej_reason_detail(rej_detail)"]
-        self.price = math_round(safe_float(dict_data["price"]), 2)
-        self.volume = safe_int(dict_data["volume"])
-        self.filled_vol = safe_int(dict_data["filled_volume(filled_vol)"])
-        self.created_at = datetime_conversion(dict_data["created_at"])
-        self.recv_at = datetime_conversion(dict_data["recv_at"])
+        self._load([dict_data[field] for field in self.csv_fields])
+
+    @classmethod
+    def from_values(cls, values):
+        """按csv_fields的顺序传入字段值，构建记录"""
+        report = cls.__new__(cls)
+        report._load(values)
+        return report
+
+    def _load(self, values):
+        (
+            self.sid,
+            self.cl_ord_id,
+            self.order_id,
+            self.symbol,
+            order_type,
+            order_side,
+            status,
+            rej_reason,
+            self.rej_detail,
+            price,
+            volume,
+            filled_vol,
+            created_at,
+            recv_at,
+        ) = values
+        self.order_type = safe_int(order_type)
+        self.order_side = safe_int(order_side)
+        self.status = safe_int(status)
+        self.rej_reason = safe_int(rej_reason)
+        self.price = math_round(safe_float(price), 2)
+        self.volume = safe_int(volume)
+        self.filled_vol = safe_int(filled_vol)
+        self.created_at = datetime_conversion(created_at)
+        self.recv_at = datetime_conversion(recv_at)
         # 暂时不需要剩下2个时间参数
 
     def toDict(self):
@@ -197,25 +328,74 @@ class GMExecReport:
     recv_at: datetime.datetime  # 终端接收时间
     # amount: float                 # 委托成交金额   --> 暂无此字段
 
+    __slots__ = (
+        "sid",
+        "cl_ord_id",
+        "order_id",
+        "exec_id",
+        "symbol",
+        "order_side",
+        "rej_reason",
+        "rej_detail",
+        "exec_type",
+        "price",
+        "volume",
+        "created_at",
+        "recv_at",
+    )
+
     # account_id,sid,scan_name,cl_ord_id,order_id,exec_id,symbol,order_type,order_business(order_biz),
     # ord_rej_reason(rej_reason),ord_rej_reason_detail(rej_detail),exec_type,price,volume,created_at,recv_at
+    csv_fields = (
+        "sid",
+        "cl_ord_id",
+        "order_id",
+        "exec_id",
+        "symbol",
+        "order_business(order_biz)",
+        "ord_rej_reason(rej_reason)",
+        "ord_rej_reason_detail(rej_detail)",
+        "exec_type",
+        "price",
+        "volume",
+        "created_at",
+        "recv_at",
+    )
 
     def __init__(self, dict_data):
-        self.sid = dict_data["sid"]
-        # self.scan_name = dict_data["scan_name"]
-        self.cl_ord_id = dict_data["cl_ord_id"]
-        self.order_id = dict_data["order_id"]
-        self.exec_id = dict_data["exec_id"]
-        self.symbol = dict_data["symbol"]
-        self.order_side = safe_int(dict_data["order_business(order_biz)"])
-        self.rej_reason = safe_int(dict_data["ord_rej_reason(rej_reason)"])
-        self.rej_detail = dict_data["ord_rej_reason_detail(rej_detail)"]
-        self.exec_type = safe_int(dict_data["exec_type"])
+        self._load([dict_data[field] for field in self.csv_fields])
+
+    @classmethod
+    def from_values(cls, values):
+        """按csv_fields的顺序传入字段值，构建记录"""
+        report = cls.__new__(cls)
+        report._load(values)
+        return report
+
+    def _load(self, values):
+        (
+            self.sid,
+            self.cl_ord_id,
+            self.order_id,
+            self.exec_id,
+            self.symbol,
+            order_side,
+            rej_reason,
+            self.rej_detail,
+            exec_type,
+            price,
+            volume,
+            created_at,
+            recv_at,
+        ) = values
+        self.order_side = safe_int(order_side)
+        self.rej_reason = safe_int(rej_reason)
+        self.exec_type = safe_int(exec_type)
         # 对价格进行指定精度处理，股票价格小数只有两位
-        self.price = math_round(safe_float(dict_data["price"]), 2)
-        self.volume = safe_int(dict_data["volume"])
-        self.created_at = datetime_conversion(dict_data["created_at"])
-        self.recv_at = datetime_conversion(dict_data["recv_at"])
+        self.price = math_round(safe_float(price), 2)
+        self.volume = safe_int(volume)
+        self.created_at = datetime_conversion(created_at)
+        self.recv_at = datetime_conversion(recv_at)
 
     def toDict(self):
         # 开发用途，正式接口不用此转换
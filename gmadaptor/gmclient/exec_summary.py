@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import cfg4py
+
+from gmadaptor.common.utils import math_round, stockcode_to_joinquant
+from gmadaptor.gmclient.csvdata import GMExecReport
+
+
+def helper_calculate_trade_fees(is_shex, amount, fees_info, order_side, is_sim):
+    """交易费用计算
+    commission: 2.5  # 券商佣金，万分之2.5
+    stamp_duty: 10 # 印花税，千分之一
+    transfer_fee: 0.1 # 过户费，万分之0.1/0.2，政策会调整
+    minimum_cost: 5.0 # 最低佣金
+    掘金客户端无印花税选项，因此，不能分开计算，佣金合并印花税
+    """
+    stamp_duty = 0
+    if is_sim:  # 模拟盘无过户费，佣金和印花税合并计算，逐笔成交均计算
+        commission = math_round(amount * fees_info.commission / 10000, 2)
+        if order_side == 2:
+            commission = math_round(
+                amount * (fees_info.commission + fees_info.stamp_duty) / 10000, 2
+            )
+        if commission < fees_info.minimum_cost:
+            commission = fees_info.minimum_cost
+        return commission
+    else:  # 实盘需要对照交割单修正，佣金按照委托为单位，过户费分上证和深证，后者不收取
+        if order_side == 2:
+            stamp_duty = math_round(amount * fees_info.stamp_duty / 10000, 2)
+        if is_shex:
+            transfer_fee = math_round(amount * fees_info.transfer_fee / 10000, 2)
+        else:
+            transfer_fee = 0  # 深证暂时不收取过户费
+        return math_round(transfer_fee + stamp_duty, 2)
+
+
+def helper_calculate_trade_fees_for_real(total_amount, fees_info):
+    """实盘券商佣金计算
+    commission: 2.5  # 券商佣金，万分之2.5
+    minimum_cost: 5.0 # 最低佣金
+    """
+    commission = math_round(total_amount * fees_info.commission / 10000, 2)
+    if commission < fees_info.minimum_cost:
+        commission = fees_info.minimum_cost
+    return commission
+
+
+class ExecSummary:
+    """单个委托的成交汇总
+
+    执行回报读取到时逐笔累加成交量、成交金额和逐笔计算的费用，生成委托结果时不再重复
+    汇总所有的成交回报。重复的回报由调用者按exec_id过滤
+    """
+
+    volume: int  # 累计成交量
+    amount: float  # 累计成交金额，逐笔四舍五入后累加
+    fees: float  # 逐笔计算的费用合计，实盘的佣金按委托计算，不在此列
+    recv_at: object  # 最后一笔成交的接收时间
+
+    __slots__ = ("volume", "amount", "fees", "recv_at")
+
+    def __init__(self):
+        self.volume = 0
+        self.amount = 0.0  # 总资金量
+        self.fees = 0  # 总手续费
+        self.recv_at = None  # 最后完成交易的时间
+
+    def add(self, exec_rpt: GMExecReport):
+        """累加一笔成交回报"""
+        server_config = cfg4py.get_instance()
+        is_shex = stockcode_to_joinquant(exec_rpt.symbol).startswith("60")
+
+        self.volume += exec_rpt.volume
+        # 价格从CSV读取时已四舍五入，对金额再次四舍五入
+        amount = math_round(exec_rpt.volume * exec_rpt.price, 2)
+        self.amount += amount
+        self.fees += helper_calculate_trade_fees(
+            is_shex,
+            amount,
+            server_config.gm_info.trade_fees,
+            exec_rpt.order_side,
+            server_config.gm_info.fake,
+        )
+        self.recv_at = exec_rpt.recv_at
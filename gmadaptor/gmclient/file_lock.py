@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import logging
+import os
+import tempfile
+from os import path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+
+class InterProcessLock:
+    """跨进程的文件锁
+
+    多进程部署时，同一个账户的文件单可能由多个worker进程写入，写入前先锁定这个账户的
+    锁文件，避免不同进程的数据行交错。锁文件放在临时目录中，不在掘金终端读取的输入目录
+    里，Windows上锁定数据文件会导致掘金终端无法读取。Linux等平台使用fcntl.flock，
+    Windows使用msvcrt.locking。
+    """
+
+    filename: str  # 锁文件
+
+    def __init__(self, name: str):
+        self.filename = path.join(tempfile.gettempdir(), f"gmadaptor-{name}.lock")
+        self._file = None
+
+    def acquire(self):
+        if self._file is None:
+            self._file = open(self.filename, "a+b")
+
+        fd = self._file.fileno()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            # 锁定第一个字节，LK_LOCK在10秒内无法锁定时抛出OSError
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+    def release(self):
+        fd = self._file.fileno()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+import sys
+from os import path
+
+logger = logging.getLogger(__name__)
+
+# inotify事件类型，见 /usr/include/linux/inotify.h
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+_IN_WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+)
+_IN_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+class PollingWatcher:
+    """轮询文件的mtime和size，发现变化的文件
+
+    非Linux平台，或者inotify不可用时使用
+    """
+
+    def __init__(self, folder: str, filenames: list):
+        self.folder = folder
+        self.filenames = filenames
+        self._stats = {}
+        self._wakeup = None  # asyncio.Event，在事件循环中创建
+
+    def start(self):
+        self._stats = {name: self._stat(name) for name in self.filenames}
+        self._wakeup = asyncio.Event()
+
+    def stop(self):
+        pass
+
+    def wake(self):
+        """结束当前的等待，立即检查一次文件"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _stat(self, name: str):
+        try:
+            st = os.stat(path.join(self.folder, name))
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _check(self) -> set:
+        changed = set()
+        for name in self.filenames:
+            st = self._stat(name)
+            if st != self._stats.get(name):
+                self._stats[name] = st
+                changed.add(name)
+        return changed
+
+    async def wait(self, timeout: float) -> set:
+        """等待timeout秒（或者被wake唤醒）后检查一次文件
+
+        Returns:
+            set: 有变化的文件名
+        """
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+        return self._check()
+
+
+class InotifyWatcher:
+    """通过inotify监控目录，文件有变化时立即唤醒等待者
+
+    目录不存在（掘金终端尚未创建账户的输出目录），或者被删除时，每次wait超时后重新
+    添加监控，添加成功后视为所有文件都有变化。
+    """
+
+    def __init__(self, folder: str, filenames: list):
+        self.folder = folder
+        self.filenames = filenames
+        self._libc = None
+        self._fd = None
+        self._wd = None  # 目录的监控描述符，目录不存在时为None
+        self._changed = set()
+        self._event = None
+
+    def start(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self._libc = libc
+        self._fd = fd
+        try:
+            if not self._add_watch():
+                logger.warning("folder not found, watch it later: %s", self.folder)
+        except OSError:
+            self._fd = None
+            os.close(fd)
+            raise
+
+        self._event = asyncio.Event()
+        asyncio.get_event_loop().add_reader(fd, self._on_readable)
+
+    def stop(self):
+        if self._fd is None:
+            return
+
+        asyncio.get_event_loop().remove_reader(self._fd)
+        os.close(self._fd)
+        self._fd = None
+        self._wd = None
+
+    def wake(self):
+        """文件变化时已经立即唤醒等待者，不需要提前检查"""
+
+    def _add_watch(self) -> bool:
+        """添加目录的监控，目录不存在时返回False"""
+        wd = self._libc.inotify_add_watch(
+            self._fd, self.folder.encode(), _IN_WATCH_MASK
+        )
+        if wd >= 0:
+            self._wd = wd
+            return True
+
+        err = ctypes.get_errno()
+        if err != errno.ENOENT:
+            raise OSError(err, f"inotify_add_watch failed: {self.folder}")
+        return False
+
+    def _on_readable(self):
+        try:
+            data = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset + _IN_EVENT.size <= len(data):
+            wd, mask, _, length = _IN_EVENT.unpack_from(data, offset)
+            offset += _IN_EVENT.size
+            # 目录中可能有非UTF-8的文件名，不能因为解码失败停止监控
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:  # 事件队列溢出，视为所有文件都有变化
+                self._changed.update(self.filenames)
+            elif mask & (IN_DELETE_SELF | IN_IGNORED):
+                # 目录被删除，监控已经失效，等目录重新创建后再添加
+                if wd == self._wd:
+                    logger.warning("folder removed, watch it later: %s", self.folder)
+                    self._wd = None
+                    self._changed.update(self.filenames)
+            elif name in self.filenames:
+                self._changed.add(name)
+
+        if self._changed:
+            self._event.set()
+
+    async def wait(self, timeout: float) -> set:
+        """等待文件变化，最多等待timeout秒
+
+        Returns:
+            set: 有变化的文件名，超时返回空集合
+        """
+        if self._wd is None:
+            try:
+                if self._add_watch():
+                    logger.info("folder watched: %s", self.folder)
+                    self._changed.update(self.filenames)
+            except OSError as e:
+                logger.warning("%s", e)
+
+        if not self._changed:
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        changed = self._changed
+        self._changed = set()
+        self._event.clear()
+        return changed
+
+
+def create_file_watcher(folder: str, filenames: list, backend: str = "auto"):
+    """创建掘金输出目录的文件监控器
+
+    Args:
+        folder (str): 账户的输出目录，gm_out_dir/<account_id>
+        filenames (list): 需要监控的文件名
+        backend (str): auto, inotify或者polling，auto在Linux上使用inotify
+
+    Returns:
+        监控器，在事件循环中调用start()后使用
+    """
+    if backend == "inotify" or (backend == "auto" and sys.platform == "linux"):
+        return InotifyWatcher(folder, filenames)
+    return PollingWatcher(folder, filenames)
+
+
+def start_file_watcher(watcher):
+    """启动监控器，inotify不可用时退回到轮询方式"""
+    try:
+        watcher.start()
+    except (OSError, AttributeError, TypeError) as e:
+        # 没有inotify的平台上，libc中没有inotify_init1（AttributeError），Windows上
+        # 找不到libc（TypeError）
+        logger.warning("inotify not available, fallback to polling: %s", e)
+        watcher = PollingWatcher(watcher.folder, watcher.filenames)
+        watcher.start()
+    return watcher
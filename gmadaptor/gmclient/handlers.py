@@ -2,41 +2,37 @@
 # @Author   : henry
 # @Time     : 2022-03-09 15:08
 import csv
+import datetime
 import logging
 
-from gmadaptor.common.types import OrderSide, OrderStatus, OrderType
+from gmadaptor.common.types import OrderStatus, TradeEvent
 from gmadaptor.gmclient.csv_utils import (
     csv_generate_cancel_orders,
     csv_generate_orders,
     csv_get_exec_report_data,
     csv_get_order_status,
+    csv_read_last_row,
+    run_in_io_executor,
 )
+from gmadaptor.gmclient.csv_reader import CSVSnapshotCache
 from gmadaptor.gmclient.csvdata import GMCash, GMPosition
 from gmadaptor.gmclient.heper_functions import (
+    helper_complete_trade_event,
     helper_get_order_status_changes,
     helper_init_trade_event,
     helper_load_trade_event,
-    helper_sum_exec_reports_by_sid,
 )
+from gmadaptor.gmclient.order_index import FINISHED_STATUS, get_order_index
 from gmadaptor.gmclient.wrapper import get_gm_out_csv_cash, get_gm_out_csv_position
 
 logger = logging.getLogger(__name__)
 
 
-async def wrapper_get_balance(account_id: str):
-    # 查询账户资金，返回cash结构
-    out_dir = get_gm_out_csv_cash(account_id)
-    if out_dir is None:
-        return {"status": 401, "msg": "no output file found"}
-
-    cash_in_csv = None
-    # target csv file has BOM at the begining, using utf-8-sig instead of utf-8
-    with open(out_dir, "r", encoding="utf-8-sig") as csvfile:
-        for row in csv.DictReader(csvfile):
-            cash_in_csv = row
-
+def _load_cash_snapshot(cash_file: str):
+    # 资金文件不断追加新的记录，只需要最后一条
+    cash_in_csv = csv_read_last_row(cash_file)
     if cash_in_csv is None:
-        return {"status": 401, "msg": "no data in cash file"}
+        return None
 
     acct_cash = {}
     try:
@@ -45,6 +41,35 @@ async def wrapper_get_balance(account_id: str):
     except Exception as e:
         logger.error("content of cash csv file: %s", cash_in_csv)
         logger.exception(e)
+    return acct_cash
+
+
+def _load_positions_snapshot(position_file: str):
+    poses = []
+    # target csv file has BOM at the begining, using utf-8-sig instead of utf-8
+    with open(position_file, "r", encoding="utf-8-sig") as csvfile:
+        for row in csv.DictReader(csvfile):
+            pos = GMPosition(row)
+            poses.append(pos.toDict())
+
+    return poses
+
+
+# 资金和持仓文件的缓存，文件未改写时直接返回已经转换好的数据
+_cash_snapshots = CSVSnapshotCache(_load_cash_snapshot, count_rows=lambda data: 1)
+_positions_snapshots = CSVSnapshotCache(_load_positions_snapshot)
+
+
+async def wrapper_get_balance(account_id: str):
+    # 查询账户资金，返回cash结构
+    out_dir = get_gm_out_csv_cash(account_id)
+    if out_dir is None:
+        return {"status": 401, "msg": "no output file found"}
+
+    acct_cash = await run_in_io_executor(_cash_snapshots.get, out_dir)
+    if acct_cash is None:
+        return {"status": 401, "msg": "no data in cash file"}
+
     return {"status": 200, "msg": "success", "data": acct_cash}
 
 
@@ -54,13 +79,7 @@ async def wrapper_get_positions(account_id: str):
     if out_dir is None:
         return {"status": 401, "msg": "no output file found"}
 
-    poses = []
-    # target csv file has BOM at the begining, using utf-8-sig instead of utf-8
-    with open(out_dir, "r", encoding="utf-8-sig") as csvfile:
-        for row in csv.DictReader(csvfile):
-            pos = GMPosition(row)
-            poses.append(pos.toDict())
-
+    poses = await run_in_io_executor(_positions_snapshots.get, out_dir)
     return {"status": 200, "msg": "success", "data": poses}
 
 
@@ -74,6 +93,34 @@ def _build_trade_events_for_submitted(order_added: dict):
     return tmp_events
 
 
+def _build_trade_events_for_failed(order_failed: dict):
+    # 参数不合法、没有写入文件单的委托，返回异常状态和原因
+    tmp_events = {}
+    for sid, (trade_info, reason) in order_failed.items():
+        if not isinstance(trade_info, dict):
+            trade_info = {}
+        now = datetime.datetime.now()
+        event = TradeEvent(
+            trade_info.get("security"),
+            trade_info.get("price"),
+            trade_info.get("volume"),
+            trade_info.get("order_side"),
+            trade_info.get("order_type"),
+            now,
+            sid,
+            OrderStatus.ERROR,
+            0.0,  # avg price
+            0,  # filled
+            "",  # order id
+            0,  # trade fees
+            reason,
+            now,  # recv at
+        )
+        tmp_events[sid] = event.toDict()
+
+    return tmp_events
+
+
 def _build_trade_events_with_status_data(order_added: dict, status_reports: dict):
     result_events = {}
     for sid in order_added:
@@ -89,42 +136,32 @@ def _build_trade_events_with_status_data(order_added: dict, status_reports: dict
     return result_events
 
 
-def _build_trade_events_with_execrpts(event_list: dict, exec_reports: dict):
+def _build_trade_events_with_execrpts(event_list: dict, exec_summaries: dict):
     result_events = {}
     for sid in event_list:
         event = event_list[sid]
-        if event.status == OrderStatus.ERROR or event.status == OrderStatus.SUBMITTED:
-            result_events[sid] = event.toDict()
-            continue
-
-        # 2,3,4的委托（以及过期的委托），再读取成交记录
-        _rpts = exec_reports.get(sid, [])
-        if _rpts:
-            helper_sum_exec_reports_by_sid(_rpts, event)
-            if event.invalid:  # 数据非法，并且已经清零
-                logger.error(
-                    "_build_events_rpts, invalid entrust: %s", event.entrust_no
-                )
-            else:
-                if event.status == OrderStatus.ALL_TX and event.filled != event.volume:
-                    event.status = OrderStatus.PARTIAL_TX
-                result_events[sid] = event.toDict()
-        else:
-            # 无执行回报的情况下，只处理状态全成的委托，文件单一般不会出这样的错误，简单处理即可
-            if event.status == OrderStatus.ALL_TX:  # 全成的委托回退一个状态，等待下次再取
-                event.status = OrderStatus.PARTIAL_TX
+        if helper_complete_trade_event(event, exec_summaries.get(sid)):
             result_events[sid] = event.toDict()
 
     return result_events
 
 
 async def wrapper_trade_action(
-    account_id: str, trade_info_list: list, timeout: int = 1000
+    account_id: str, trade_info_list: list, timeout: int = 1000, wait: bool = True
 ):
-    # 写入扫单文件
-    order_added = await csv_generate_orders(account_id, trade_info_list)
+    # 写入扫单文件，参数不合法的委托不写入，在结果中返回异常状态
+    order_added, order_failed = {}, {}
+    result = await csv_generate_orders(account_id, trade_info_list)
+    if result is not None:  # 账户存在
+        order_added, order_failed = result
     if not order_added:  # 一个都没写入，全部撤回
         return {"status": 501, "msg": "failed to append data to order file"}
+    failed_events = _build_trade_events_for_failed(order_failed)
+
+    if not wait:  # 异步提交，写入文件单后返回“已报”，之后通过/order_status查询
+        _data = _build_trade_events_for_submitted(order_added)
+        _data.update(failed_events)
+        return {"status": 200, "msg": "submitted", "data": _data}
 
     # 读取状态变化文件，传递超时参数
     sidlist = order_added.keys()
@@ -132,19 +169,19 @@ async def wrapper_trade_action(
     if not status_reports:  # 文件单输出模式启动失败（文件不存在），或者服务异常
         # 已经写入文件单的委托返回“已报”
         _data = _build_trade_events_for_submitted(order_added)
+        _data.update(failed_events)
         return {"status": 200, "msg": "return with errors", "data": _data}
 
     # 构建返回的委托结果字典
     event_list = _build_trade_events_with_status_data(order_added, status_reports)
 
-    # 取出所有执行报告中的委托数据
+    # 从索引中取出执行报告中的委托数据
     new_sid_list = list(status_reports.keys())
-    exec_reports = await csv_get_exec_report_data(account_id, new_sid_list)
-    if exec_reports is None:
-        logger.error("not data found in exec report file: %s", new_sid_list)
-        exec_reports = {}
+    index = get_order_index(account_id)
+    exec_summaries = await index.get_latest_exec_summaries(new_sid_list)
 
-    result_events = _build_trade_events_with_execrpts(event_list, exec_reports)
+    result_events = _build_trade_events_with_execrpts(event_list, exec_summaries)
+    result_events.update(failed_events)
     return {"status": 200, "msg": "success", "data": result_events}
 
 
@@ -174,11 +211,10 @@ async def wrapper_cancel_entursts(
             "msg": f"cancel_entrusts, status change not found: {account_id}",
         }
 
-    # 读取有效委托的执行回报数据
+    # 读取有效委托的执行回报数据，无数据不影响撤销的正确性，以委托的最终状态为准
     new_sid_list = list(status_reports.keys())
-    exec_reports = await csv_get_exec_report_data(account_id, new_sid_list)
-    if exec_reports is None:  # 无数据不影响撤销的正确性，以委托的最终状态为准
-        return {"status": 500, "msg": "cancel_entrusts, exec report file not found"}
+    index = get_order_index(account_id)
+    exec_summaries = await index.get_latest_exec_summaries(new_sid_list)
 
     event_list = {}
     # order_status无成交信息，order_status_change无成交价格
@@ -186,30 +222,63 @@ async def wrapper_cancel_entursts(
         event = helper_load_trade_event(report)
         event_list[event.entrust_no] = event
 
-    result_events = _build_trade_events_with_execrpts(event_list, exec_reports)
+    result_events = _build_trade_events_with_execrpts(event_list, exec_summaries)
     return {"status": 200, "msg": "success", "data": result_events}
 
 
-async def wrapper_get_today_all_entrusts(account_id: str):
-    # 取出所有日内委托数据
-    all_entrusts = await csv_get_order_status(account_id)
-    if not all_entrusts:
+async def wrapper_get_order_status(
+    account_id: str, sid_list: list, timeout: int = 0, mode: str = "all"
+):
+    # 从委托状态索引中查询委托，timeout大于0时等待委托执行完毕，不读取文件
+    # mode为all时等待全部委托执行完毕，any时等待任意一个委托执行完毕
+    index = get_order_index(account_id)
+    if index is None:
+        return {"status": 500, "msg": "order_status, order index not found"}
+
+    if timeout > 0:
+        reports = await index.wait_orders_finished(sid_list, timeout / 1000, mode)
+    else:
+        reports = index.get_order_reports(sid_list)
+
+    finished = 0
+    for report in reports.values():
+        if report.status in FINISHED_STATUS:
+            finished += 1
+    if mode == "any":
+        done = finished > 0
+    else:
+        done = finished == len(set(sid_list))
+
+    event_list = {}
+    for sid, report in reports.items():
+        event_list[sid] = helper_load_trade_event(report)
+    exec_summaries = await index.get_latest_exec_summaries(list(reports.keys()))
+
+    result_events = _build_trade_events_with_execrpts(event_list, exec_summaries)
+    return {"status": 200, "msg": "success", "data": result_events, "done": done}
+
+
+async def wrapper_get_today_all_entrusts(account_id: str, sid_list: list = None):
+    # 取出日内委托数据，sid_list非空时只取出需要的委托
+    all_entrusts = await csv_get_order_status(account_id, sid_list)
+    if all_entrusts is None or (not all_entrusts and not sid_list):
         return {
             "status": 500,
             "msg": "today_entrusts, order status not found of this account",
         }
 
     # 取出所有执行报告中的委托数据
-    all_exec_rpts = await csv_get_exec_report_data(account_id, None)
-    if all_exec_rpts is None:
-        return {"status": 500, "msg": "today_entrusts, exec report file not found"}
+    index = get_order_index(account_id)
+    if index is None:
+        return {"status": 500, "msg": "today_entrusts, order index not found"}
+    all_exec_summaries = index.get_exec_summaries(sid_list)
 
     event_list = {}
     for entrust in all_entrusts:
         event = helper_load_trade_event(entrust)
         event_list[event.entrust_no] = event
 
-    result_events = _build_trade_events_with_execrpts(event_list, all_exec_rpts)
+    result_events = _build_trade_events_with_execrpts(event_list, all_exec_summaries)
     return {"status": 200, "msg": "success", "data": result_events}
 
 
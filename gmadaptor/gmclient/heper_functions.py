@@ -1,15 +1,17 @@
-import asyncio
 import datetime
 import logging
 from os import path
-from time import sleep
 
 import cfg4py
 
 from gmadaptor.common.types import OrderSide, OrderStatus, OrderType, TradeEvent
 from gmadaptor.common.utils import math_round, stockcode_to_joinquant
-from gmadaptor.gmclient.csv_utils import csv_get_order_status_change_data_by_sidlist
 from gmadaptor.gmclient.csvdata import GMOrderReport
+from gmadaptor.gmclient.exec_summary import (
+    ExecSummary,
+    helper_calculate_trade_fees_for_real,
+)
+from gmadaptor.gmclient.order_index import get_order_index
 from gmadaptor.gmclient.wrapper import get_gm_out_csv_order_status_change
 
 logger = logging.getLogger(__name__)
@@ -64,72 +66,25 @@ def helper_load_trade_event(order_status_record: GMOrderReport) -> TradeEvent:
     return event
 
 
-def helper_calculate_trade_fees(is_shex, amount, fees_info, order_side, is_sim):
-    """交易费用计算
-    commission: 2.5  # 券商佣金，万分之2.5
-    stamp_duty: 10 # 印花税，千分之一
-    transfer_fee: 0.1 # 过户费，万分之0.1/0.2，政策会调整
-    minimum_cost: 5.0 # 最低佣金
-    掘金客户端无印花税选项，因此，不能分开计算，佣金合并印花税
-    """
-    stamp_duty = 0
-    if is_sim:  # 模拟盘无过户费，佣金和印花税合并计算，逐笔成交均计算
-        commission = math_round(amount * fees_info.commission / 10000, 2)
-        if order_side == 2:
-            commission = math_round(
-                amount * (fees_info.commission + fees_info.stamp_duty) / 10000, 2
-            )
-        if commission < fees_info.minimum_cost:
-            commission = fees_info.minimum_cost
-        return commission
-    else:  # 实盘需要对照交割单修正，佣金按照委托为单位，过户费分上证和深证，后者不收取
-        if order_side == 2:
-            stamp_duty = math_round(amount * fees_info.stamp_duty / 10000, 2)
-        if is_shex:
-            transfer_fee = math_round(amount * fees_info.transfer_fee / 10000, 2)
-        else:
-            transfer_fee = 0  # 深证暂时不收取过户费
-        return math_round(transfer_fee + stamp_duty, 2)
-
+# 更新读取到的委托交易信息（执行回报文件中的数据）
+def helper_sum_exec_reports_by_sid(exec_reports, event: TradeEvent):
+    summary = ExecSummary()
+    for exec_rpt in exec_reports:  # 从执行回报中取详细数据
+        summary.add(exec_rpt)
 
-def helper_calculate_trade_fees_for_real(total_amount, fees_info):
-    """实盘券商佣金计算
-    commission: 2.5  # 券商佣金，万分之2.5
-    minimum_cost: 5.0 # 最低佣金
-    """
-    commission = math_round(total_amount * fees_info.commission / 10000, 2)
-    if commission < fees_info.minimum_cost:
-        commission = fees_info.minimum_cost
-    return commission
+    return helper_apply_exec_summary(summary, event)
 
 
-# 更新读取到的委托交易信息（执行回报文件中的数据）
-def helper_sum_exec_reports_by_sid(exec_reports, event: TradeEvent):
+# 用委托的成交汇总更新交易信息
+def helper_apply_exec_summary(summary: ExecSummary, event: TradeEvent):
     server_config = cfg4py.get_instance()
     trade_fees_info = server_config.gm_info.trade_fees
     is_sim = server_config.gm_info.fake
-    is_shex = False
-    if event.code.startswith("60"):
-        is_shex = True
 
-    total_volume = 0
-    total_amount = 0.0  # 总资金量
-    total_commission = 0  # 总手续费
-    recv_at = None  # 最后完成交易的时间
-
-    for exec_rpt in exec_reports:  # 从执行回报中取详细数据
-        total_volume += exec_rpt.volume
-        # 价格从CSV读取时已四舍五入，对金额再次四舍五入
-        amount = math_round(exec_rpt.volume * exec_rpt.price, 2)
-        total_amount += amount
-        total_commission += helper_calculate_trade_fees(
-            is_shex,
-            amount,
-            trade_fees_info,
-            exec_rpt.order_side,
-            is_sim,
-        )
-        recv_at = exec_rpt.recv_at
+    total_volume = summary.volume
+    total_amount = summary.amount  # 总资金量
+    total_commission = summary.fees  # 总手续费
+    recv_at = summary.recv_at  # 最后完成交易的时间
 
     if not is_sim:  # 实盘针对委托计算佣金
         commission = helper_calculate_trade_fees_for_real(total_amount, trade_fees_info)
@@ -184,6 +139,27 @@ def helper_sum_exec_reports_by_sid(exec_reports, event: TradeEvent):
         return 0
 
 
+# 用成交汇总补全委托的成交数据，返回False表示数据非法
+def helper_complete_trade_event(event: TradeEvent, summary: ExecSummary) -> bool:
+    if event.status == OrderStatus.ERROR or event.status == OrderStatus.SUBMITTED:
+        return True
+
+    # 2,3,4的委托（以及过期的委托），再读取成交记录
+    if summary is not None:
+        helper_apply_exec_summary(summary, event)
+        if event.invalid:  # 数据非法，并且已经清零
+            logger.error("_build_events_rpts, invalid entrust: %s", event.entrust_no)
+            return False
+        if event.status == OrderStatus.ALL_TX and event.filled != event.volume:
+            event.status = OrderStatus.PARTIAL_TX
+    else:
+        # 无执行回报的情况下，只处理状态全成的委托，文件单一般不会出这样的错误，简单处理即可
+        if event.status == OrderStatus.ALL_TX:  # 全成的委托回退一个状态，等待下次再取
+            event.status = OrderStatus.PARTIAL_TX
+
+    return True
+
+
 # 循环读取执行回报之前，清除掉交易信息
 def helper_reset_event(event, invalid=False):
     event.avg_price = 0
@@ -207,20 +183,12 @@ async def helper_get_order_status_changes(
         )
         return None
 
-    reports = {}  # 定义成空值，避免和None冲突
-    while timeout > 0:
-        result = await csv_get_order_status_change_data_by_sidlist(
-            status_file, sid_list
-        )
-        result_status = result["result"]
-        if result_status != -1:  # 有任何结果先保存(-1表示没查到结果)
-            reports = result["reports"]
-
-        if result_status == 0:  # 获取完结状态的信息
-            break
+    index = get_order_index(account_id)
+    if index is None:
+        return None
 
-        await asyncio.sleep(200 / 1000)
-        timeout -= 200
+    # 每个委托等待各自的完成状态，超时时返回最新的状态
+    reports = await index.wait_orders_finished(sid_list, timeout / 1000)
 
     if not reports:
         logger.error(
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+import logging
+import os
+import time
+from collections import deque
+from itertools import islice
+
+from gmadaptor.gmclient.heper_functions import (
+    helper_complete_trade_event,
+    helper_load_trade_event,
+)
+from gmadaptor.gmclient.order_index import order_indexes
+
+logger = logging.getLogger(__name__)
+
+# 每个账户一个委托事件流
+order_event_streams = {}
+
+
+class OrderEventStream:
+    """委托状态推送流
+
+    委托状态索引每次读取到新数据后，检查有变化的委托，状态或者成交量发生变化时，
+    生成一个TradeEvent.toDict()格式的事件，分配递增的序号后放入队列。订阅者记录收到
+    的最后一个序号，断线重连后从这个序号之后继续接收；队列只保留最近的maxlen个事件，
+    更早的事件已经丢弃时，订阅者需要重新查询/today_entrusts。
+
+    事件id为"epoch-seq"，epoch标识生成事件的进程。多进程部署或者服务重启后，重连到
+    另一个进程时epoch不同，序号不能延续，按事件已经丢弃处理。
+
+    每个委托最后推送的状态用于去重，只保留当天、并且仍在索引中的委托。
+    """
+
+    account_id: str  # 掘金交易账号ID
+    epoch: str  # 进程标识
+    seq: int  # 最后一个事件的序号，从1开始
+
+    def __init__(self, account_id: str, maxlen: int = 10000):
+        self.account_id = account_id
+        self.epoch = f"{os.getpid()}.{int(time.time())}"
+        self.seq = 0
+        self._events = deque(maxlen=maxlen)  # (seq, event)
+        self._states = {}  # sid -> (status, filled)，最后推送的状态
+        self._day = datetime.date.today()  # _states所属的交易日
+        self._changed = None  # asyncio.Event，在事件循环中创建
+
+    def on_orders_changed(self, index, sid_set: set):
+        """委托状态索引的回调函数"""
+        self._prune_states(index)
+
+        summaries = index.exec_summaries
+        for sid in sid_set:
+            report = index.orders.get(sid)
+            if report is None:  # 成交回报先于状态变化到达
+                continue
+
+            event = helper_load_trade_event(report)
+            if not helper_complete_trade_event(event, summaries.get(sid)):
+                continue
+
+            state = (event.status, event.filled)
+            if self._states.get(sid) == state:
+                continue
+            self._states[sid] = state
+
+            self.seq += 1
+            self._events.append((self.seq, event.toDict()))
+
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def _prune_states(self, index):
+        """新的交易日清空推送状态；索引重新读取文件后，丢弃已经不在索引中的委托"""
+        today = datetime.date.today()
+        if today != self._day:
+            self._day = today
+            self._states.clear()
+        elif len(self._states) > len(index.orders):
+            orders = index.orders
+            self._states = {
+                sid: state for sid, state in self._states.items() if sid in orders
+            }
+
+    def parse_event_id(self, event_id: str) -> int:
+        """解析客户端收到的最后一个事件id，也可以只有序号
+
+        Returns:
+            int: 事件的序号，事件来自其它进程时返回-1
+
+        Raises:
+            ValueError: id格式不正确
+        """
+        epoch, _, seq = event_id.rpartition("-")
+        if epoch and epoch != self.epoch:
+            return -1
+        return int(seq)
+
+    def events_since(self, seq: int):
+        """取出序号大于seq的事件
+
+        Returns:
+            tuple: (events, complete)，events为[(seq, event)]；complete为False时，
+                序号seq之后的部分事件已经丢弃
+        """
+        if seq < 0 or seq > self.seq:  # 事件来自其它进程，或者服务重启前
+            return list(self._events), False
+        if not self._events or seq == self.seq:
+            return [], True
+
+        first = self._events[0][0]
+        if seq < first - 1:
+            return list(self._events), False
+
+        return list(islice(self._events, seq - first + 1, None)), True
+
+    async def wait(self, seq: int, timeout: float) -> bool:
+        """等待序号大于seq的事件，最多等待timeout秒
+
+        Returns:
+            bool: 是否有新的事件
+        """
+        if seq < self.seq:
+            return True
+
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+        return seq < self.seq
+
+
+def get_order_event_stream(account_id: str):
+    stream = order_event_streams.get(account_id)
+    if stream is None:
+        logger.warning("order event stream not found: %s", account_id)
+    return stream
+
+
+def order_event_register_all():
+    """为每个委托状态索引创建事件流，在索引启动之前调用，不遗漏当天已有的委托"""
+    for account_id, index in order_indexes.items():
+        if account_id in order_event_streams:
+            continue
+
+        stream = OrderEventStream(account_id)
+        index.add_listener(stream.on_orders_changed)
+        order_event_streams[account_id] = stream
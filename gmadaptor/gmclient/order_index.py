@@ -0,0 +1,453 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+import logging
+import time
+from os import path
+
+from gmadaptor.common import metrics
+from gmadaptor.gmclient.csv_reader import CSVTailReader, run_in_io_executor
+from gmadaptor.gmclient.csvdata import (
+    GMExecReport,
+    GMOrderReport,
+    csv_record_parser,
+)
+from gmadaptor.gmclient.exec_summary import ExecSummary
+from gmadaptor.gmclient.file_watcher import (
+    PollingWatcher,
+    create_file_watcher,
+    start_file_watcher,
+)
+from gmadaptor.gmclient.order_trace import order_traces
+
+logger = logging.getLogger(__name__)
+
+# 每个账户一个委托状态索引
+order_indexes = {}
+
+# 执行完毕状态: 3已成, 5已撤, 8已拒, 9挂起, 12已过期
+FINISHED_STATUS = (3, 5, 8, 9, 12)
+
+# 统计耗时的委托数量上限，掘金没有输出状态的委托超过上限后丢弃最早的
+MAX_TRACKED_ORDERS = 100000
+
+# 轮询方式下，最后一个委托写入后这个秒数内，以busy_interval的间隔检查文件
+TRACKED_BUSY_SECONDS = 60
+
+
+class OrderStateIndex:
+    """委托状态索引
+
+    由一个后台任务增量读取状态变化文件和执行回报文件，在内存中维护每个委托的最新状态
+    和成交回报。请求处理函数直接查询索引，并通过wait_changed等待索引更新，
+    读取文件的开销不再随并发请求的数量增加。文件在IO线程池中读取和解析，解析出的
+    记录回到事件循环中再更新索引，索引只在事件循环中修改和查询，不需要加锁。
+
+    等待委托完成时，每个委托对应一个future，读取到执行完毕的状态后立即唤醒等待者；
+    后台任务只在文件监控器通知文件有变化时才读取文件，inotify方式下文件变化会立即
+    唤醒后台任务。没有inotify时轮询文件的mtime和size：有等待者，或者刚写入过委托时
+    以busy_interval的间隔检查，其它时间以interval的间隔检查。
+    """
+
+    account_id: str  # 掘金交易账号ID
+    orders: dict  # sid -> 最新的GMOrderReport
+    exec_summaries: dict  # sid -> ExecSummary，成交回报读取时逐笔累加
+    exec_ids: set  # 已经累加的成交回报的exec_id（或者sid等字段），用于过滤重复的回报
+
+    def __init__(
+        self,
+        account_id: str,
+        status_change_file: str,
+        exec_report_file: str,
+        interval: float = 0.2,
+        watcher_backend: str = "auto",
+        busy_interval: float = 0.01,
+    ):
+        self.account_id = account_id
+        self.orders = {}
+        self.exec_summaries = {}
+        self.exec_ids = set()
+        self._exec_day = datetime.date.today()  # 成交回报所属的日期
+        self.interval = interval
+        self.busy_interval = busy_interval
+
+        self._status_reader = CSVTailReader(status_change_file)
+        self._exec_reader = CSVTailReader(exec_report_file)
+        self._filenames = {
+            path.basename(status_change_file),
+            path.basename(exec_report_file),
+        }
+        self._watcher = create_file_watcher(
+            path.dirname(status_change_file), list(self._filenames), watcher_backend
+        )
+        self._changed = None  # asyncio.Event，在事件循环中创建
+        self._task = None
+        self._waiters = {}  # sid -> [asyncio.Future]
+        self._listeners = []  # 索引更新后的回调函数
+        self._changed_sids = set()  # 本次读取中有变化的委托
+        self._refresh_lock = None  # asyncio.Lock，读取文件、更新索引时持有
+        self._refreshes = 0  # 读取文件的次数
+        self._tracked = {}  # sid -> [写入时间, 写入时的读取次数, 是否已有状态]
+
+    def _apply_status_changes(self, reports: list, restarted: bool) -> bool:
+        if restarted:
+            self.orders.clear()
+
+        for report in reports:
+            # 按文件顺序更新，最后的总是最新的
+            self.orders[report.sid] = report
+            self._changed_sids.add(report.sid)
+            if report.sid in self._tracked:
+                self._observe_tracked(report)
+            trace = order_traces.get((self.account_id, report.sid))
+            if trace is not None:
+                trace.on_status(report, report.status in FINISHED_STATUS)
+
+        return restarted or bool(reports)
+
+    def _observe_tracked(self, report: GMOrderReport):
+        tracked = self._tracked[report.sid]
+
+        elapsed = time.monotonic() - tracked[0]
+        if not tracked[2]:
+            tracked[2] = True
+            metrics.order_first_status_seconds.labels(self.account_id).observe(elapsed)
+
+        if report.status in FINISHED_STATUS:
+            del self._tracked[report.sid]
+            metrics.order_terminal_status_seconds.labels(self.account_id).observe(
+                elapsed
+            )
+            metrics.order_polls.labels(self.account_id).observe(
+                self._refreshes - tracked[1]
+            )
+
+    def _reset_exec_reports(self):
+        self.exec_summaries.clear()
+        self.exec_ids.clear()
+
+    def _apply_exec_reports(self, reports: list, restarted: bool) -> bool:
+        # 执行回报文件被替换或者改写后从头读取，丢弃之前读取的回报；跨日后丢弃前一天
+        # 的回报。掘金重复输出的回报按exec_id过滤掉，没有exec_id的回报按
+        # (sid, created_at, volume, price)过滤
+        today = datetime.date.today()
+        if restarted or today != self._exec_day:
+            self._reset_exec_reports()
+            self._exec_day = today
+
+        for report in reports:
+            if report.exec_type != 15:  # 15成交，19执行有异常
+                continue
+            key = report.exec_id
+            if not key:
+                key = (report.sid, report.created_at, report.volume, report.price)
+            if key in self.exec_ids:  # 重复的回报
+                continue
+            self.exec_ids.add(key)
+
+            trace = order_traces.get((self.account_id, report.sid))
+            if trace is not None:
+                trace.on_exec_report(report)
+
+            summary = self.exec_summaries.get(report.sid)
+            if summary is None:
+                summary = ExecSummary()
+                self.exec_summaries[report.sid] = summary
+            summary.add(report)
+            self._changed_sids.add(report.sid)
+
+        return restarted or bool(reports)
+
+    def _read_files(self):
+        """在IO线程中读取两个文件新增的数据并解析，不修改索引
+
+        Returns:
+            tuple: (状态变化, 执行回报)，每个文件为(记录列表, 是否从头读取)
+        """
+        return (
+            _read_reports(self._status_reader, GMOrderReport),
+            _read_reports(self._exec_reader, GMExecReport),
+        )
+
+    async def refresh(self) -> bool:
+        """读取两个文件新增的数据，有变化时唤醒等待者
+
+        Returns:
+            bool: 索引是否有更新
+        """
+        # 调用者被取消时（比如客户端断开），读取到的变化仍然要通知等待者
+        return await asyncio.shield(self._refresh())
+
+    async def _refresh(self) -> bool:
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+
+        # 同一时间只有一个读取，按读取的先后更新索引
+        async with self._refresh_lock:
+            try:
+                status_changes, exec_reports = await run_in_io_executor(
+                    self._read_files
+                )
+            except Exception as e:
+                logger.exception(e)
+                return False
+
+            self._refreshes += 1
+            changed = self._apply_status_changes(*status_changes)
+            changed = self._apply_exec_reports(*exec_reports) or changed
+            changed_sids = self._changed_sids
+            self._changed_sids = set()
+
+        if changed and self._changed is not None:
+            self._changed.set()
+            self._changed = asyncio.Event()
+
+        if changed_sids:
+            self._wake_waiters(changed_sids)
+            for listener in self._listeners:
+                try:
+                    listener(self, changed_sids)
+                except Exception as e:
+                    logger.exception(e)
+
+        return changed
+
+    def _wake_waiters(self, sid_list):
+        """唤醒已经执行完毕的委托的等待者"""
+        for sid in sid_list:
+            if sid not in self._waiters:
+                continue
+            report = self.orders.get(sid)
+            if report is None or report.status not in FINISHED_STATUS:
+                continue
+            for waiter in self._waiters.pop(sid):
+                if not waiter.done():
+                    waiter.set_result(report)
+
+    def track_orders(self, sid_list):
+        """记录委托写入文件单的时间，读取到委托的第一条状态和执行完毕的状态时，
+        统计耗时和期间读取文件的次数"""
+        now = time.monotonic()
+        for sid in sid_list:
+            self._tracked[sid] = [now, self._refreshes, False]
+
+        while len(self._tracked) > MAX_TRACKED_ORDERS:
+            del self._tracked[next(iter(self._tracked))]
+        self._watcher.wake()
+
+    def add_listener(self, listener):
+        """注册索引更新的回调函数
+
+        Args:
+            listener: 参数为(index, sid_set)，sid_set为本次读取中状态或者成交回报
+                有变化的委托，在事件循环中调用
+        """
+        self._listeners.append(listener)
+
+    def start(self):
+        """启动后台读取任务，必须在事件循环中调用"""
+        if self._task is not None:
+            return
+
+        self._changed = asyncio.Event()
+        self._watcher = start_file_watcher(self._watcher)
+        self._task = asyncio.ensure_future(self._run())
+        logger.info("order state index started: %s", self.account_id)
+
+    def stop(self):
+        """停止后台读取任务和文件监控器"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._watcher.stop()
+
+    async def _run(self):
+        await self.refresh()
+        while True:
+            changed = await self._watcher.wait(self._wait_interval())
+            if changed & self._filenames:
+                await self.refresh()
+
+    def _wait_interval(self) -> float:
+        """轮询方式下，有等待者或者刚写入过委托时缩短检查的间隔"""
+        if not isinstance(self._watcher, PollingWatcher):
+            return self.interval
+        if self._waiters:
+            return self.busy_interval
+        if self._tracked:
+            written_at = self._tracked[next(reversed(self._tracked))][0]
+            if time.monotonic() - written_at < TRACKED_BUSY_SECONDS:
+                return self.busy_interval
+        return self.interval
+
+    async def wait_changed(self, timeout: float) -> bool:
+        """等待索引更新
+
+        Args:
+            timeout (float): 等待的秒数
+
+        Returns:
+            bool: 超时之前索引是否有更新
+        """
+        self.start()
+
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def wait_orders_finished(
+        self, sid_list: list, timeout: float, mode: str = "all"
+    ) -> dict:
+        """等待委托执行完毕，直到全部完成（mode为any时任意一个完成）或者超时
+
+        Args:
+            sid_list (list): 委托的sid列表
+            timeout (float): 等待的秒数，以单调时钟计算截止时间
+            mode (str): all或者any
+
+        Returns:
+            dict: sid -> GMOrderReport，包括超时时尚未完成的委托的最新状态
+        """
+        self.start()
+
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+
+        waiters = {}
+        for sid in sid_list:
+            if sid in waiters:
+                continue
+            report = self.orders.get(sid)
+            if report is not None and report.status in FINISHED_STATUS:
+                continue
+            waiter = loop.create_future()
+            self._waiters.setdefault(sid, []).append(waiter)
+            waiters[sid] = waiter
+
+        if waiters:
+            # 刚写入委托的情况下，先读取一次，不必等待后台任务；检查等待者注册之前
+            # 已经被其它读取更新的委托
+            await self.refresh()
+            self._wake_waiters(list(waiters))
+            pending = [w for w in waiters.values() if not w.done()]
+            if pending:
+                self._watcher.wake()  # 以busy_interval开始检查
+            if mode == "any" and len(pending) < len(set(sid_list)):
+                pending = []  # 已经有执行完毕的委托
+
+            time_left = deadline - loop.time()
+            if pending and time_left > 0:
+                if mode == "any":
+                    return_when = asyncio.FIRST_COMPLETED
+                else:
+                    return_when = asyncio.ALL_COMPLETED
+                done, _ = await asyncio.wait(
+                    pending, timeout=time_left, return_when=return_when
+                )
+                if not done or (mode == "all" and len(done) < len(pending)):
+                    metrics.order_wait_timeouts.labels(self.account_id, mode).inc()
+
+            # 清除超时未完成的等待者
+            for sid, waiter in waiters.items():
+                if waiter.done():
+                    continue
+                waiter.cancel()
+                sid_waiters = self._waiters.get(sid)
+                if sid_waiters is None:
+                    continue
+                if waiter in sid_waiters:
+                    sid_waiters.remove(waiter)
+                if not sid_waiters:
+                    del self._waiters[sid]
+
+        return self.get_order_reports(sid_list)
+
+    def get_order_reports(self, sid_list: list) -> dict:
+        result_reports = {}
+        for sid in sid_list:
+            report = self.orders.get(sid)
+            if report is not None:
+                result_reports[sid] = report
+        return result_reports
+
+    async def get_latest_exec_summaries(self, sid_list: list) -> dict:
+        """取出委托的成交汇总。执行回报文件比状态变化文件更新得晚，状态中的成交量多于
+        已经读取的成交回报时，先读一次新增的数据，不必等后台任务
+        """
+        for sid in sid_list:
+            report = self.orders.get(sid)
+            summary = self.exec_summaries.get(sid)
+            if report is not None and report.filled_vol > (
+                summary.volume if summary is not None else 0
+            ):
+                await self.refresh()
+                break
+
+        return self.get_exec_summaries(sid_list)
+
+    def get_exec_summaries(self, sid_list: list = None) -> dict:
+        """取出委托的成交汇总，sid_list为空时返回所有委托的数据"""
+        if not sid_list:
+            return dict(self.exec_summaries)
+
+        summaries = {}
+        for sid in sid_list:
+            if sid in self.exec_summaries:
+                summaries[sid] = self.exec_summaries[sid]
+        return summaries
+
+
+def _read_reports(reader: CSVTailReader, record_type) -> tuple:
+    """读取文件新增的数据行，解析为record_type的记录"""
+    t0 = time.perf_counter()
+    rows, restarted = reader.read_rows()
+    if not rows:
+        return [], restarted
+
+    parse = csv_record_parser(record_type, reader.header)
+    reports = []
+    for row in rows:
+        try:
+            reports.append(parse(row))
+        except (IndexError, ValueError) as e:
+            logger.warning("invalid row: %s, %s, %s", reader.filename, row, e)
+
+    metrics.observe_csv_parse(reader.filename, time.perf_counter() - t0, len(rows))
+    return reports, restarted
+
+
+def order_index_register(
+    account_id: str,
+    status_change_file: str,
+    exec_report_file: str,
+    watcher_backend: str = "auto",
+    poll_interval: float = 0.2,
+    busy_interval: float = 0.01,
+):
+    order_indexes[account_id] = OrderStateIndex(
+        account_id,
+        status_change_file,
+        exec_report_file,
+        interval=poll_interval,
+        watcher_backend=watcher_backend,
+        busy_interval=busy_interval,
+    )
+
+
+def get_order_index(account_id: str):
+    index = order_indexes.get(account_id)
+    if index is None:
+        logger.warning("order state index not found: %s", account_id)
+    return index
+
+
+def order_index_start_all():
+    for index in order_indexes.values():
+        index.start()
+
+
+def order_index_stop_all():
+    for index in order_indexes.values():
+        index.stop()
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+import datetime
+import logging
+import time
+from contextvars import ContextVar
+
+import cfg4py
+
+logger = logging.getLogger(__name__)
+
+# 委托处理的各个阶段，按先后顺序
+# received: 收到请求；written: 写入文件单并flush；first_status: 状态变化文件中第一次出现；
+# terminal: 读取到执行完毕的状态；exec_report: 执行回报文件中第一次出现；
+# responded: 生成请求的响应；cancel_written: 写入撤单
+TRACE_STAGES = (
+    "received",
+    "written",
+    "first_status",
+    "terminal",
+    "exec_report",
+    "responded",
+    "cancel_written",
+)
+
+# (account_id, sid) -> OrderTrace，只跟踪本进程写入的委托，超过上限后丢弃最早的。
+# 不同账户的客户端可能使用相同的sid
+order_traces = {}
+_trace_size = None
+
+# 当前请求的开始时间和请求中写入的委托，由webapi的中间件设置
+_request_context = ContextVar("order_trace_request", default=None)
+
+
+class OrderTrace:
+    """委托的处理过程
+
+    以单调时钟（time.perf_counter）记录每个阶段第一次发生的时间，同时记录掘金在状态
+    变化文件和执行回报文件中输出的created_at、recv_at，用于区分适配器本身的耗时和
+    掘金终端的延迟。
+    """
+
+    sid: str
+    account_id: str  # 掘金交易账号ID
+    stages: dict  # 阶段 -> 单调时钟的时间
+    gm: dict  # 阶段 -> 掘金输出的时间
+
+    def __init__(self, sid: str, account_id: str):
+        self.sid = sid
+        self.account_id = account_id
+        self.stages = {}
+        self.gm = {}
+        # 单调时钟与系统时间的对应关系，用于换算成系统时间
+        self._clock = (time.perf_counter(), time.time())
+
+    def mark(self, stage: str, t: float = None):
+        if stage not in self.stages:
+            self.stages[stage] = time.perf_counter() if t is None else t
+
+    def on_status(self, report, finished: bool):
+        """读取到委托的状态变化"""
+        if "first_status" not in self.stages:
+            self.mark("first_status")
+            self.gm["first_status"] = _gm_times(report)
+        if finished and "terminal" not in self.stages:
+            self.mark("terminal")
+            self.gm["terminal"] = _gm_times(report)
+
+    def on_exec_report(self, report):
+        """读取到委托的成交回报"""
+        if "exec_report" not in self.stages:
+            self.mark("exec_report")
+            self.gm["exec_report"] = _gm_times(report)
+
+    def toDict(self):
+        # 各阶段的时间以相对于第一个阶段的毫秒数表示，start为第一个阶段的系统时间
+        origin = min(self.stages.values())
+        start = self._clock[1] + origin - self._clock[0]
+        stages = {}
+        for stage in TRACE_STAGES:
+            if stage in self.stages:
+                stages[stage] = round((self.stages[stage] - origin) * 1000, 3)
+
+        return {
+            "sid": self.sid,
+            "account": self.account_id,
+            "start": datetime.datetime.fromtimestamp(start).strftime(
+                "%Y-%m-%d %H:%M:%S.%f"
+            ),
+            "stages": stages,
+            "gm": self.gm,
+        }
+
+
+def _gm_times(report) -> dict:
+    return {
+        "created_at": report.created_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
+        "recv_at": report.recv_at.strftime("%Y-%m-%d %H:%M:%S.%f"),
+    }
+
+
+def _get_trace_size() -> int:
+    global _trace_size
+    if _trace_size is None:
+        gm_info = cfg4py.get_instance().gm_info
+        _trace_size = getattr(gm_info, "order_trace_size", None)
+        if _trace_size is None:
+            _trace_size = 10000
+    return _trace_size
+
+
+def trace_request_begin(start_time: float):
+    """请求开始时调用，之后写入的委托以start_time为received阶段的时间"""
+    _request_context.set((start_time, []))
+
+
+def trace_request_end():
+    """请求的响应生成后调用，记录请求中写入的委托的responded阶段"""
+    context = _request_context.get()
+    if context is None:
+        return
+
+    now = time.perf_counter()
+    for key in context[1]:
+        trace = order_traces.get(key)
+        if trace is not None:
+            trace.mark("responded", now)
+
+
+def trace_orders_written(account_id: str, sid_list):
+    """委托写入文件单后调用，开始跟踪这些委托"""
+    size = _get_trace_size()
+    if size <= 0:
+        return
+
+    now = time.perf_counter()
+    context = _request_context.get()
+    for sid in sid_list:
+        key = (account_id, sid)
+        trace = OrderTrace(sid, account_id)
+        if context is not None:
+            trace.mark("received", context[0])
+            context[1].append(key)
+        trace.mark("written", now)
+        order_traces.pop(key, None)  # 重复的sid，放到最后
+        order_traces[key] = trace
+
+    while len(order_traces) > size:
+        del order_traces[next(iter(order_traces))]
+
+
+def trace_cancels_written(account_id: str, sid_list):
+    """撤单写入文件单后调用，只记录已经在跟踪的委托"""
+    now = time.perf_counter()
+    for sid in sid_list:
+        trace = order_traces.get((account_id, sid))
+        if trace is not None:
+            trace.mark("cancel_written", now)
+
+
+def get_order_trace(account_id: str, sid: str):
+    return order_traces.get((account_id, sid))
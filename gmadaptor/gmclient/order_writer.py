@@ -0,0 +1,409 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from os import path
+
+import cfg4py
+
+from gmadaptor.common import metrics
+from gmadaptor.gmclient.file_lock import InterProcessLock
+from gmadaptor.gmclient.wrapper import get_gm_account_info
+
+logger = logging.getLogger(__name__)
+
+ORDER_FILE_HEADER = (
+    "sid,account_id,symbol,volume,order_type,order_business(order_biz),price,comment\n"
+)
+CANCEL_FILE_HEADER = "sid,comment\n"
+
+# 文件单的持久化方式
+# flush: 写入后只flush到操作系统，掘金终端可以立即读到，机器掉电时可能丢失
+# fsync-per-request: 每次写入后fsync，写入到磁盘后才返回
+# group-fsync: 多次写入合并一次fsync，两次fsync的间隔不小于group_fsync_interval
+DURABILITY_MODES = ("flush", "fsync-per-request", "group-fsync")
+
+# 每个账户一个写入任务，第一次写入时创建
+order_writers = {}
+
+
+class DailyInputFile:
+    """当天的文件单输入文件
+
+    文件名按日期生成（YYYYMMDD.order.csv），日期不变时复用已打开的文件，每次写入只有
+    一次write系统调用；跨日后关闭前一天的文件，打开当天的文件。文件为空时写入表头，
+    每个文件只写一次。写入前检查文件是否被删除或者替换，是则重新打开。只在账户的
+    写入线程中使用。
+    """
+
+    folder: str  # 账户的输入目录
+    filename: str  # 当前打开的文件
+
+    def __init__(self, folder: str, suffix: str, header: str):
+        self.folder = folder
+        self.filename = None
+        self._suffix = suffix
+        self._header = header
+        self._day = None
+        self._file = None
+
+    def _open(self, day: datetime.date):
+        self.close()
+
+        csvfile = "%4d%02d%02d.%s" % (day.year, day.month, day.day, self._suffix)
+        filename = path.normpath(path.join(self.folder, csvfile))
+        # 追加模式下文件非空时，utf-8-sig不会再写入BOM
+        f = open(filename, "a", encoding="utf-8-sig")
+        if f.tell() == 0:
+            f.write(self._header)
+
+        self._file = f
+        self._day = day
+        self.filename = filename
+        logger.info("input file opened: %s", filename)
+
+    @property
+    def is_open(self) -> bool:
+        return self._file is not None
+
+    def _replaced(self) -> bool:
+        """打开的文件是否已经被删除、替换或者截断"""
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return True
+
+        fst = os.fstat(self._file.fileno())
+        return st.st_ino != fst.st_ino or st.st_size != fst.st_size or st.st_size == 0
+
+    def write(self, data: str):
+        day = datetime.date.today()
+        if self._file is None or day != self._day:
+            self._open(day)
+        elif self._replaced():
+            logger.info("input file removed or replaced, reopen: %s", self.filename)
+            self._open(day)
+
+        try:
+            self._file.write(data)
+            # save to disk immediately
+            self._file.flush()
+        except OSError:
+            # 下次写入时重新打开
+            self.close()
+            raise
+
+    def sync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is None:
+            return
+
+        try:
+            self._file.close()
+        except OSError as e:
+            logger.warning("failed to close input file: %s, %s", self.filename, e)
+        self._file = None
+        self._day = None
+
+
+class OrderFileWriter:
+    """文件单写入任务
+
+    同一个账户的委托和撤单请求放入队列，由一个后台任务依次取出。第一个请求到达后，
+    再等待window秒，期间到达的请求合并为一次写入和一次flush，按durability的设置
+    fsync之后，再通知每个请求的调用者。文件操作在账户专用的线程中执行，同一账户的
+    写入按到达顺序进行。
+
+    group-fsync方式下，请求同样立即写入和flush，掘金终端马上可以读到；只有fsync推迟到
+    距离上次fsync满group_interval秒时执行，这段时间内写入的请求共用一次fsync，fsync
+    之后才通知调用者。
+
+    输入文件在写入之间保持打开，超过idle_close秒没有写入时关闭，每日维护时可以删除
+    文件，前一天的文件也不会一直打开。
+
+    多进程部署时，每个worker进程有自己的写入任务，写入时再以process_lock在进程间互斥。
+    """
+
+    account_id: str  # 掘金交易账号ID
+    window: float  # 合并写入的等待时间，秒
+    durability: str  # 持久化方式，见DURABILITY_MODES
+    group_interval: float  # group-fsync方式下两次fsync的最小间隔，秒
+    idle_close: float  # 没有写入超过这个秒数时关闭输入文件
+    stats: dict  # 写入次数和耗时统计
+
+    def __init__(
+        self,
+        account_id: str,
+        acct_info: list,
+        window: float = 0.002,
+        durability: str = "flush",
+        group_interval: float = 0.01,
+        process_lock: InterProcessLock = None,
+        idle_close: float = 10,
+    ):
+        self.account_id = account_id
+        self.window = window
+        self.durability = durability
+        self.group_interval = group_interval
+        self.idle_close = idle_close
+        self.stats = {
+            "batches": 0,  # 写入次数
+            "requests": 0,  # 写入的请求数
+            "write_seconds": 0.0,  # write和flush的累计耗时
+            "sync_seconds": 0.0,  # fsync的累计耗时
+            "max_sync_seconds": 0.0,
+            "ack_seconds": 0.0,  # 请求从提交到写入完成的累计耗时
+            "max_ack_seconds": 0.0,
+        }
+        self._last_sync = 0.0  # 上次fsync的时间，事件循环时钟
+        self._sync_task = None  # group-fsync方式下等待执行的fsync任务
+        self._sync_kinds = set()  # 等待fsync的文件
+        self._sync_waiters = []  # 等待fsync之后通知的调用者
+        self._acct_info = acct_info
+        self._process_lock = process_lock
+        self._files = {
+            "order": DailyInputFile(acct_info[1], "order.csv", ORDER_FILE_HEADER),
+            "cancel": DailyInputFile(
+                acct_info[1], "cancel_order.csv", CANCEL_FILE_HEADER
+            ),
+        }
+        self._queue = None  # asyncio.Queue，在事件循环中创建
+        self._task = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=f"order_writer_{account_id[:8]}"
+        )
+
+    def start(self):
+        """启动后台写入任务，必须在事件循环中调用"""
+        if self._task is not None:
+            return
+
+        self._queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+        logger.info("order file writer started: %s", self.account_id)
+
+    async def write_orders(self, lines: list) -> bool:
+        """写入委托，写入文件后返回
+
+        Args:
+            lines (list): 委托文件的数据行，以换行符结尾
+
+        Returns:
+            bool: 是否写入成功
+        """
+        return await self._submit("order", lines)
+
+    async def write_cancel_orders(self, lines: list) -> bool:
+        """写入撤单，写入文件后返回"""
+        return await self._submit("cancel", lines)
+
+    async def _submit(self, kind: str, lines: list) -> bool:
+        self.start()
+
+        loop = asyncio.get_event_loop()
+        t0 = loop.time()
+        waiter = loop.create_future()
+        self._queue.put_nowait((kind, lines, waiter))
+        written = await waiter
+
+        elapsed = loop.time() - t0
+        metrics.order_write_ack_seconds.labels(self.account_id).observe(elapsed)
+        self.stats["ack_seconds"] += elapsed
+        self.stats["max_ack_seconds"] = max(self.stats["max_ack_seconds"], elapsed)
+        return written
+
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            if any(f.is_open for f in self._files.values()):
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), self.idle_close)
+                except asyncio.TimeoutError:
+                    await loop.run_in_executor(self._executor, self._close_input_files)
+                    continue
+            else:
+                request = await self._queue.get()
+
+            requests = [request]
+            if self.window > 0:
+                await asyncio.sleep(self.window)
+            while not self._queue.empty():
+                requests.append(self._queue.get_nowait())
+
+            try:
+                await loop.run_in_executor(self._executor, self._write, requests)
+                written = True
+            except Exception as e:
+                logger.warning("write file orders failed: %s, %s", self.account_id, e)
+                written = False
+
+            logger.debug(
+                "file orders written: %s, %d requests", self.account_id, len(requests)
+            )
+            waiters = [waiter for _, _, waiter in requests]
+            if written and self.durability == "group-fsync":
+                self._sync_kinds.update(kind for kind, _, _ in requests)
+                self._sync_waiters.extend(waiters)
+                if self._sync_task is None:
+                    self._sync_task = asyncio.ensure_future(self._group_sync())
+            else:
+                self._notify(waiters, written)
+
+    async def _group_sync(self):
+        """等到距离上次fsync满group_interval秒，一次fsync之前写入的文件"""
+        loop = asyncio.get_event_loop()
+        delay = self._last_sync + self.group_interval - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        # 交给执行器之前取走等待的调用者，之后写入的请求由下一次fsync负责
+        kinds, self._sync_kinds = self._sync_kinds, set()
+        waiters, self._sync_waiters = self._sync_waiters, []
+        self._sync_task = None
+        self._last_sync = loop.time()
+        try:
+            await loop.run_in_executor(self._executor, self._sync, kinds)
+            synced = True
+        except Exception as e:
+            logger.warning("fsync file orders failed: %s, %s", self.account_id, e)
+            synced = False
+        self._notify(waiters, synced)
+
+    @staticmethod
+    def _notify(waiters: list, written: bool):
+        for waiter in waiters:
+            # 调用者可能已经取消（比如客户端断开）
+            if not waiter.done():
+                waiter.set_result(written)
+
+    def _write(self, requests: list):
+        data = {}
+        for kind, lines, _ in requests:
+            data.setdefault(kind, []).extend(lines)
+
+        t0 = time.perf_counter()
+        with self._acct_info[2], self._process_lock or nullcontext():
+            for kind, lines in data.items():
+                self._files[kind].write("".join(lines))
+
+            t1 = time.perf_counter()
+            if self.durability == "fsync-per-request":
+                for kind in data:
+                    self._files[kind].sync()
+        t2 = time.perf_counter()
+
+        stats = self.stats
+        stats["batches"] += 1
+        stats["requests"] += len(requests)
+        stats["write_seconds"] += t1 - t0
+        if self.durability == "fsync-per-request":
+            self._add_sync_stats(t2 - t1)
+
+    def _sync(self, kinds: set):
+        t0 = time.perf_counter()
+        for kind in kinds:
+            self._files[kind].sync()
+        self._add_sync_stats(time.perf_counter() - t0)
+
+    def _add_sync_stats(self, seconds: float):
+        stats = self.stats
+        stats["sync_seconds"] += seconds
+        stats["max_sync_seconds"] = max(stats["max_sync_seconds"], seconds)
+
+    async def stop(self):
+        """停止写入任务，关闭打开的文件"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self._executor, self._close_files)
+
+        # 关闭之前已经fsync过，通知还在等待的调用者
+        waiters, self._sync_waiters = self._sync_waiters, []
+        self._sync_kinds = set()
+        self._notify(waiters, True)
+
+    def _close_input_files(self):
+        for f in self._files.values():
+            if f.is_open:
+                logger.debug("close idle input file: %s", f.filename)
+                if self.durability != "flush":
+                    # group-fsync方式下可能还有没有fsync的写入
+                    try:
+                        f.sync()
+                    except OSError as e:
+                        logger.warning("fsync input file failed: %s, %s", f.filename, e)
+                f.close()
+
+    def _close_files(self):
+        self._close_input_files()
+        if self._process_lock is not None:
+            self._process_lock.close()
+
+
+def get_order_writer(account_id: str):
+    writer = order_writers.get(account_id)
+    if writer is not None:
+        return writer
+
+    acct_info = get_gm_account_info(account_id)
+    if acct_info is None:
+        return None
+
+    # 合并写入的等待时间，毫秒
+    gm_info = cfg4py.get_instance().gm_info
+    window_ms = getattr(gm_info, "order_write_window", None)
+    if window_ms is None:
+        window_ms = 2
+
+    durability = getattr(gm_info, "order_durability", None) or "flush"
+    if durability not in DURABILITY_MODES:
+        logger.warning("unknown order_durability %s, use flush", durability)
+        durability = "flush"
+    interval_ms = getattr(gm_info, "group_fsync_interval", None) or 10
+    idle_close = getattr(gm_info, "order_file_idle_close", None) or 10
+
+    # 多个worker进程写入同一个文件时，需要跨进程的锁；按账户分进程时只有一个进程写入
+    process_lock = None
+    server_info = cfg4py.get_instance().server_info
+    if (getattr(server_info, "workers", None) or 1) > 1 and not getattr(
+        server_info, "shard_by_account", None
+    ):
+        process_lock = InterProcessLock(account_id)
+
+    writer = OrderFileWriter(
+        account_id,
+        acct_info,
+        window_ms / 1000,
+        durability,
+        interval_ms / 1000,
+        process_lock,
+        idle_close,
+    )
+    order_writers[account_id] = writer
+    return writer
+
+
+def _collect_writer_stats():
+    for account_id, writer in order_writers.items():
+        for key, value in writer.stats.items():
+            metrics.order_writer_stats.labels(account_id, key).set(value)
+
+
+metrics.add_collector(_collect_writer_stats)
+
+
+async def order_writer_stop_all():
+    for writer in order_writers.values():
+        await writer.stop()
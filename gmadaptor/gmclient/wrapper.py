@@ -1,7 +1,6 @@
 # -*- coding: utf-8 -*-
 # @Author   : henry
 # @Time     : 2022-03-09 15:08
-import datetime
 import logging
 import os
 from os import path
@@ -9,6 +8,8 @@ from threading import Lock
 
 import cfg4py
 
+from gmadaptor.gmclient.order_index import order_index_register
+
 logger = logging.getLogger(__name__)
 
 gm_out_dir = ""
@@ -78,32 +79,6 @@ def get_gm_out_csv_order_status_change(account_id: str):
         return None
 
 
-def get_gm_in_csv_order(account_info: list):
-    home = account_info[1]
-    if not path.exists(home):
-        logger.error(
-            "input folder for account %s not exist, please check your config file", home
-        )
-        return None
-
-    time1 = datetime.datetime.now()
-    csvfile = "%4d%02d%02d.order.csv" % (time1.year, time1.month, time1.day)
-    return path.normpath(path.join(home, csvfile))
-
-
-def get_gm_in_csv_cancelorder(account_info: list):
-    home = account_info[1]
-    if not path.exists(home):
-        logger.error(
-            "input folder for account %s not exist, please check your config file", home
-        )
-        return None
-
-    time1 = datetime.datetime.now()
-    csvfile = "%4d%02d%02d.cancel_order.csv" % (time1.year, time1.month, time1.day)
-    return path.normpath(path.join(home, csvfile))
-
-
 def get_gm_account_info(account_id: str):
     if account_id not in account_list.keys():
         logger.warn("account id not found in account list: %s", account_id)
@@ -112,7 +87,13 @@ def get_gm_account_info(account_id: str):
     return account_list[account_id]
 
 
-def gm_client_wrapper_start() -> int:
+def gm_client_wrapper_start(account_ids: list = None) -> int:
+    """加载账户，为每个账户注册委托状态索引
+
+    Args:
+        account_ids (list, optional): 只加载这些账户，按账户分进程运行时使用。
+            默认加载配置中的全部账户
+    """
     server_config = cfg4py.get_instance()
     gm_info = server_config.gm_info
 
@@ -122,10 +103,18 @@ def gm_client_wrapper_start() -> int:
         logger.error("output folder of this gm client not found: %s", gm_out_dir)
         return -1
 
+    # 输出文件的监控方式：auto, inotify, polling
+    watcher_backend = getattr(gm_info, "file_watcher", None) or "auto"
+    # 轮询方式下检查文件的间隔，毫秒；有等待者时使用较短的间隔
+    poll_interval = (getattr(gm_info, "file_poll_interval", None) or 200) / 1000
+    busy_interval = (getattr(gm_info, "file_poll_busy_interval", None) or 10) / 1000
+
     accounts = server_config.gm_info.accounts
     for account in accounts:
         acct_name = account["name"]
         acct_id = account["acct_id"]
+        if account_ids is not None and acct_id not in account_ids:
+            continue
         acct_input = os.path.expanduser(account["acct_input"])
         if not path.exists(acct_input):
             logger.fatal(
@@ -144,5 +133,15 @@ def gm_client_wrapper_start() -> int:
         ]
         logger.info(f"account added: {acct_id}, {acct_name}, {acct_input}")
 
+        # 每个账户一个委托状态索引，后台任务在服务启动后开始读取
+        order_index_register(
+            acct_id,
+            get_gm_out_csv_order_status_change(acct_id),
+            get_gm_out_csv_execreport(acct_id),
+            watcher_backend,
+            poll_interval,
+            busy_interval,
+        )
+
     # begin processing file orders
     return 0
@@ -49,3 +49,18 @@ def calculate_timeout_in_ms(
         return 60 * 1000
 
     return int(timeout * 1000)
+
+
+def check_async_mode(value) -> bool:
+    """检查委托请求的async参数，为true时写入文件单后立即返回，不等待委托的执行结果
+
+    Args:
+        value: 用户传入的参数，可以是布尔值或者字符串"true"
+
+    Returns:
+        bool: 是否异步提交
+    """
+    if isinstance(value, str):
+        return value.lower() in ("true", "1")
+
+    return value is True
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import logging
+
+import httpx
+from sanic import Blueprint, Sanic, response
+
+from gmadaptor.httpserver.helper import check_request_token, make_response
+
+logger = logging.getLogger(__name__)
+
+bp_router = Blueprint("router", strict_slashes=False)
+
+# 账户 -> 处理这个账户请求的进程地址
+account_shards = {}
+
+# 转发请求的客户端，服务启动后创建
+_client = None
+
+# 逐跳的请求头和响应头，不转发
+_HOP_HEADERS = {
+    "connection",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+    "host",
+    "content-length",
+}
+
+
+@bp_router.listener("before_server_start")
+async def start_router_client(app, loop):
+    global _client
+    # 长轮询和推送接口的响应时间不确定，不限制读取时间
+    _client = httpx.AsyncClient(
+        timeout=httpx.Timeout(5.0, read=None),
+        limits=httpx.Limits(max_connections=None, max_keepalive_connections=100),
+    )
+
+
+@bp_router.listener("after_server_stop")
+async def stop_router_client(app, loop):
+    if _client is not None:
+        await _client.aclose()
+
+
+@bp_router.route("/", methods=["GET"])
+async def bp_router_default_route(request):
+    return response.text("gm file order wrapper")
+
+
+@bp_router.route("/<path:path>", methods=["GET", "POST"])
+async def bp_router_forward(request, path: str):
+    """按Account-ID把请求转发到处理这个账户的进程，响应以流的方式返回"""
+    token = request.headers.get("Authorization")
+    if not check_request_token(token):
+        return response.json(make_response(401, "invalid access token"), 401)
+
+    account_id = request.headers.get("Account-ID") or request.args.get("account_id")
+    shard = account_shards.get(account_id)
+    if shard is None:
+        return response.json(make_response(401, "invalid Account-ID"), 401)
+
+    headers = {
+        name: value
+        for name, value in request.headers.items()
+        if name.lower() not in _HOP_HEADERS
+    }
+    upstream_request = _client.build_request(
+        request.method,
+        f"{shard}/{path}",
+        params=request.query_string,
+        headers=headers,
+        content=request.body,
+    )
+    try:
+        upstream = await _client.send(upstream_request, stream=True)
+    except httpx.HTTPError as e:
+        logger.error("failed to forward request: %s, %s, %s", account_id, path, e)
+        return response.json(make_response(502, "account worker not available"), 502)
+
+    try:
+        resp = await request.respond(
+            status=upstream.status_code,
+            headers={
+                name: value
+                for name, value in upstream.headers.items()
+                if name.lower() not in _HOP_HEADERS and name.lower() != "content-type"
+            },
+            content_type=upstream.headers.get("content-type"),
+        )
+        async for chunk in upstream.aiter_raw():
+            await resp.send(chunk)
+        await resp.eof()
+    finally:
+        await upstream.aclose()
+
+
+def router_start(port: int, shards: dict):
+    """启动转发请求的前端服务
+
+    Args:
+        port (int): 服务端口
+        shards (dict): 账户 -> 处理这个账户请求的进程地址，比如http://127.0.0.1:9001
+    """
+    account_shards.update(shards)
+
+    app = Sanic("trader-gm-adaptor-router")
+    app.blueprint(bp_router)
+    print(f"router initialized, accounts: {len(shards)}")
+    app.run(host="0.0.0.0", port=port, single_process=True)
@@ -2,17 +2,28 @@
 # @Author   : henry
 # @Time     : 2022-03-09 15:08
 import logging
+import sys
 
 from sanic import Sanic
+from sanic.worker.loader import AppLoader
 
-from gmadaptor.httpserver.webapi import initialize_blueprint
+from gmadaptor.httpserver.webapi import bp_gm_adaptor, initialize_blueprint
 
 logger = logging.getLogger(__name__)
 
 app = Sanic("trader-gm-adaptor")
 
 
-def server_start(port: int = 9000) -> int:
+def get_app() -> Sanic:
+    """返回注册了接口的sanic应用，多次调用只注册一次"""
+    if bp_gm_adaptor.name not in app.blueprints:
+        initialize_blueprint(app)
+    return app
+
+
+def server_start(
+    port: int = 9000, workers: int = 1, app_factory=None, host: str = "0.0.0.0"
+) -> int:
     """_summary_
 
     this is am example
@@ -29,6 +40,20 @@ def server_start(port: int = 9000) -> int:
     Returns:
         int: _description_
     """
-    initialize_blueprint(app)
-    print("server initialized")
-    app.run(host="0.0.0.0", port=port, single_process=True)
+    if workers <= 1:
+        initialize_blueprint(app)
+        print("server initialized")
+        app.run(host=host, port=port, single_process=True)
+        return 0
+
+    # 多进程模式，每个worker进程通过app_factory创建应用，并有自己的委托状态索引、
+    # 文件单写入任务和缓存。Linux上fork的子进程直接继承主进程初始化好的配置和账户，
+    # 其它平台上spawn的子进程由app_factory重新初始化
+    if sys.platform == "linux":
+        Sanic.start_method = "fork"
+    loader = AppLoader(factory=app_factory)
+    primary = loader.load()
+    primary.prepare(host=host, port=port, workers=workers)
+    print(f"server initialized, workers: {workers}")
+    Sanic.serve(primary=primary, app_loader=loader)
+    return 0
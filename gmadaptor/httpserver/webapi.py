@@ -1,14 +1,35 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import logging
+import math
+import re
+import time
 
 from sanic import Blueprint, Sanic, request, response
+from sanic.response import json_dumps
 
 import gmadaptor.gmclient.handlers as handler
+from gmadaptor.common import metrics
 from gmadaptor.common.types import OrderSide, OrderType
-from gmadaptor.gmclient.wrapper import check_gm_account
+from gmadaptor.gmclient.order_events import (
+    get_order_event_stream,
+    order_event_register_all,
+)
+from gmadaptor.gmclient.order_index import (
+    order_index_start_all,
+    order_index_stop_all,
+)
+from gmadaptor.gmclient.order_trace import (
+    get_order_trace,
+    order_traces,
+    trace_request_begin,
+    trace_request_end,
+)
+from gmadaptor.gmclient.order_writer import order_writer_stop_all
+from gmadaptor.gmclient.wrapper import account_list, check_gm_account
 from gmadaptor.httpserver.helper import (
     calculate_timeout_in_ms,
+    check_async_mode,
     check_request_token,
     make_response,
 )
@@ -17,6 +38,43 @@ logger = logging.getLogger(__name__)
 bp_gm_adaptor = Blueprint("gmclient", strict_slashes=False)
 
 
+@bp_gm_adaptor.listener("before_server_start")
+async def start_order_indexes(app, loop):
+    # 每个账户一个后台任务，读取状态变化和执行回报文件
+    order_event_register_all()
+    order_index_start_all()
+
+
+@bp_gm_adaptor.listener("after_server_stop")
+async def stop_order_writers(app, loop):
+    # 关闭保持打开的文件单输入文件和文件监控器
+    order_index_stop_all()
+    await order_writer_stop_all()
+
+
+@bp_gm_adaptor.middleware("request")
+async def start_request_timer(request):
+    request.ctx.start_time = time.perf_counter()
+    trace_request_begin(request.ctx.start_time)
+
+
+@bp_gm_adaptor.middleware("response")
+async def observe_request_latency(request, response):
+    # 分块发送的响应在开始发送时统计
+    start_time = getattr(request.ctx, "start_time", None)
+    if start_time is None:
+        return
+    trace_request_end()
+
+    endpoint = request.route.path if request.route else "unknown"
+    account = request.headers.get("Account-ID") or request.args.get("account_id")
+    if account not in account_list:  # 避免无效的账户产生过多的标签
+        account = ""
+    metrics.http_request_seconds.labels(endpoint, account, response.status).observe(
+        time.perf_counter() - start_time
+    )
+
+
 @bp_gm_adaptor.middleware("request")
 async def validate_request(request):
     # check access_token first
@@ -46,7 +104,8 @@ async def bp_mock_get_balance(request):
     if result["status"] != 200:
         logger.info(f"balance result: {result['msg']}")
 
-        # try again
+        # 资金文件读取过一次之后会缓存最后的有效数据，只有服务启动后
+        # 第一次读取时（比如文件正在被改写）才需要等待后重试
         await asyncio.sleep(1)
         result = await handler.wrapper_get_balance(account_id)
         if result["status"] != 200:
@@ -100,7 +159,10 @@ async def bp_mock_buy(request):
         "limit_price": 0,
     }
 
-    result = await handler.wrapper_trade_action(account_id, [trade_info], timeout_in_ms)
+    wait = not check_async_mode(request.json.get("async"))
+    result = await handler.wrapper_trade_action(
+        account_id, [trade_info], timeout_in_ms, wait
+    )
     if result["status"] != 200:
         logger.info(f"buy result: {result['msg']}")
         return response.json(make_response(-1, result["msg"]))
@@ -146,7 +208,10 @@ async def bp_mock_market_buy(request):
         "limit_price": limit_price,
     }
 
-    result = await handler.wrapper_trade_action(account_id, [trade_info], timeout_in_ms)
+    wait = not check_async_mode(request.json.get("async"))
+    result = await handler.wrapper_trade_action(
+        account_id, [trade_info], timeout_in_ms, wait
+    )
     if result["status"] != 200:
         logger.info(f"market_buy result: {result['msg']}")
         return response.json(make_response(-1, result["msg"]))
@@ -184,7 +249,10 @@ async def bp_mock_sell(request):
         "cid": sid,
         "limit_price": 0,
     }
-    result = await handler.wrapper_trade_action(account_id, [trade_info], timeout_in_ms)
+    wait = not check_async_mode(request.json.get("async"))
+    result = await handler.wrapper_trade_action(
+        account_id, [trade_info], timeout_in_ms, wait
+    )
     if result["status"] != 200:
         logger.info(f"sell result: {result['msg']}")
         return response.json(make_response(-1, result["msg"]))
@@ -228,7 +296,10 @@ async def bp_mock_market_sell(request):
         "cid": sid,
         "limit_price": 0,
     }
-    result = await handler.wrapper_trade_action(account_id, [trade_info], timeout_in_ms)
+    wait = not check_async_mode(request.json.get("async"))
+    result = await handler.wrapper_trade_action(
+        account_id, [trade_info], timeout_in_ms, wait
+    )
     if result["status"] != 200:
         logger.info(f"market_sell result: {result['msg']}")
         return response.json(make_response(-1, result["msg"]))
@@ -257,8 +328,9 @@ async def bp_mock_batch_sell(request):
 
     logger.info(f"batch_sell: timeout->{timeout_in_ms}, info list->{sell_info_list}")
 
+    wait = not check_async_mode(request.json.get("async"))
     result = await handler.wrapper_trade_action(
-        account_id, sell_info_list, timeout_in_ms
+        account_id, sell_info_list, timeout_in_ms, wait
     )
     if result["status"] != 200:
         logger.info(f"batch_sell result: {result['msg']}")
@@ -270,6 +342,132 @@ async def bp_mock_batch_sell(request):
     return response.json(make_response(0, "OK", data))
 
 
+# 聚宽格式的证券代码，写入文件单时转换成掘金格式
+_SECURITY_PATTERN = re.compile(r"[0-9]{6}\.(XSHG|XSHE)")
+
+
+def _parse_volume(volume) -> int:
+    """委托数量必须是正整数，不截断小数"""
+    if isinstance(volume, str) and volume.isdigit():
+        volume = int(volume)
+    elif isinstance(volume, float) and volume.is_integer():
+        volume = int(volume)
+    if isinstance(volume, bool) or not isinstance(volume, int):
+        raise ValueError("volume must be integer")
+    if volume <= 0:
+        raise ValueError("volume must be positive")
+    return volume
+
+
+def _parse_price(price, name: str = "price") -> float:
+    if isinstance(price, bool) or not isinstance(price, (int, float, str)):
+        raise ValueError(f"{name} must be number")
+    try:
+        price = float(price)
+    except ValueError:
+        raise ValueError(f"{name} must be number") from None
+    if not math.isfinite(price) or price < 0:
+        raise ValueError(f"{name} must be positive")
+    return price
+
+
+def _parse_batch_order(order):
+    """检查批量委托中的一笔委托，返回(trade_info, 错误信息)"""
+    if not isinstance(order, dict):
+        return None, "order must be object"
+
+    symbol = order.get("security")
+    sid = order.get("cid")
+    volume = order.get("volume")
+    price = order.get("price")
+    if not symbol or not sid or volume is None:
+        return None, "security, volume and cid cannot be empty"
+
+    # 文件单是CSV格式，cid中不能有逗号和换行符
+    if not isinstance(sid, str) or any(c in sid for c in ",\r\n"):
+        return None, "cid must be string without comma or line break"
+    if not isinstance(symbol, str) or not _SECURITY_PATTERN.fullmatch(symbol):
+        return None, "security must be like 000001.XSHE"
+
+    try:
+        volume = _parse_volume(volume)
+        order_side = OrderSide(order.get("order_side"))
+        order_type = OrderType(order.get("order_type", OrderType.LIMIT))
+        if order_type == OrderType.LIMIT:
+            if price is None:
+                return None, "price cannot be empty for limit order"
+            price = _parse_price(price)
+            if price == 0:
+                return None, "price must be positive"
+            limit_price = 0
+        else:  # 市价交易暂时不用价格，及限价参数
+            price = 0 if price is None else _parse_price(price)
+            limit_price = _parse_price(order.get("limit_price") or 0, "limit_price")
+    except (TypeError, ValueError) as e:
+        return None, str(e)
+
+    trade_info = {
+        "security": symbol,
+        "volume": volume,
+        "price": price,
+        "order_side": order_side,
+        "order_type": order_type,
+        "cid": sid,
+        "limit_price": limit_price,
+    }
+    return trade_info, None
+
+
+@bp_gm_adaptor.route("/batch_orders", methods=["POST"])
+async def bp_mock_batch_orders(request):
+    # 一次提交多笔买入、卖出，限价或者市价委托，一次写入文件单，一起等待结果
+    account_id = request.headers.get("Account-ID")
+
+    order_list = request.json.get("orders", None)
+    if not order_list:
+        logger.info("order list is empty: %s", account_id)
+        return response.json(make_response(-1, "parameter cannot be empty"))
+    if not isinstance(order_list, list):
+        logger.info("order list must be array: %s", account_id)
+        return response.json(make_response(-1, "parameter is not array-like"))
+
+    # 全部检查通过后才写入文件单
+    trade_info_list = []
+    sids = set()
+    for i, order in enumerate(order_list):
+        trade_info, err = _parse_batch_order(order)
+        if err is None and trade_info["cid"] in sids:
+            err = "duplicated cid"
+        if err is not None:
+            logger.info("batch_orders: invalid order %d, %s, %s", i, err, order)
+            return response.json(make_response(-1, f"invalid order {i}: {err}"))
+
+        sids.add(trade_info["cid"])
+        trade_info_list.append(trade_info)
+
+    timeout = request.json.get("timeout")
+    timeout_in_ms = calculate_timeout_in_ms(timeout, 1)
+
+    logger.info(
+        "batch_orders: account->%s, orders->%d, timeout->%d",
+        account_id,
+        len(trade_info_list),
+        timeout_in_ms,
+    )
+
+    wait = not check_async_mode(request.json.get("async"))
+    result = await handler.wrapper_trade_action(
+        account_id, trade_info_list, timeout_in_ms, wait
+    )
+    if result["status"] != 200:
+        logger.info(f"batch_orders result: {result['msg']}")
+        return response.json(make_response(-1, result["msg"]))
+
+    data = result["data"]
+    logger.info(f"batch_orders result: \n{data}")
+    return response.json(make_response(0, "OK", data))
+
+
 @bp_gm_adaptor.route("/cancel_entrust", methods=["POST"])
 async def bp_mock_cancel_entrust(request):
     # 支持单个委托的撤销指令
@@ -343,6 +541,94 @@ async def bp_mock_cancel_entrusts(request):
         return response.json(make_response(0, "OK", datalist))
 
 
+@bp_gm_adaptor.route("/order_status", methods=["POST"])
+async def bp_get_order_status(request):
+    """查询委托的最新状态，数据来自内存中的委托状态索引，不读取文件
+
+    timeout大于0时，等待所有委托执行完毕（已成、已撤、已拒等）或者超时后返回，
+    用于异步提交（async=true）的委托查询结果；尚未出现在状态变化文件中的委托不返回
+    """
+    account_id = request.headers.get("Account-ID")
+
+    sid_list = request.json.get("entrust_no")
+    if not isinstance(sid_list, list) or len(sid_list) == 0:
+        logger.info("order_status: no entrust ID list provided")
+        return response.json(make_response(400, "no entrust ID list provided"))
+
+    timeout = request.json.get("timeout")
+    timeout_in_ms = calculate_timeout_in_ms(timeout, 0, 0)
+    logger.info(
+        "order_status: account->%s, entrusts->%s, timeout->%d",
+        account_id,
+        sid_list,
+        timeout_in_ms,
+    )
+
+    result = await handler.wrapper_get_order_status(account_id, sid_list, timeout_in_ms)
+    if result["status"] != 200:
+        logger.info(f"order_status result: {result['msg']}")
+        return response.json(make_response(-1, result["msg"]))
+
+    datalist = result["data"]
+    if len(datalist) == 0:
+        logger.info("order_status result: no results found")
+        return response.json(make_response(1, "no results found"))
+
+    logger.info("order_status result: %d entrusts", len(datalist))
+    return response.json(make_response(0, "OK", datalist))
+
+
+@bp_gm_adaptor.route("/wait_orders", methods=["POST"])
+async def bp_wait_orders(request):
+    """等待委托执行完毕，mode为all（默认）时等待全部委托，any时等待任意一个委托
+
+    截止时间由deadline（unix时间戳，秒）或者timeout（秒）指定，最长60秒。条件满足时
+    立即返回，status为0；超时返回时status为1，data中仍然包括委托的最新状态
+    """
+    account_id = request.headers.get("Account-ID")
+
+    sid_list = request.json.get("entrust_no")
+    if not isinstance(sid_list, list) or len(sid_list) == 0:
+        logger.info("wait_orders: no entrust ID list provided")
+        return response.json(make_response(400, "no entrust ID list provided"))
+
+    mode = request.json.get("mode", "all")
+    if mode not in ("all", "any"):
+        logger.info("wait_orders: invalid mode, %s", mode)
+        return response.json(make_response(400, "mode must be all or any"))
+
+    timeout = request.json.get("timeout")
+    deadline = request.json.get("deadline")
+    if deadline is not None:
+        try:
+            timeout = max(float(deadline) - time.time(), 0)
+        except (TypeError, ValueError):
+            return response.json(make_response(400, "invalid deadline"))
+    timeout_in_ms = calculate_timeout_in_ms(timeout, 0)
+    logger.info(
+        "wait_orders: account->%s, entrusts->%s, mode->%s, timeout->%d",
+        account_id,
+        sid_list,
+        mode,
+        timeout_in_ms,
+    )
+
+    result = await handler.wrapper_get_order_status(
+        account_id, sid_list, timeout_in_ms, mode
+    )
+    if result["status"] != 200:
+        logger.info(f"wait_orders result: {result['msg']}")
+        return response.json(make_response(-1, result["msg"]))
+
+    datalist = result["data"]
+    logger.info(
+        "wait_orders result: %d entrusts, done->%s", len(datalist), result["done"]
+    )
+    if not result["done"]:
+        return response.json(make_response(1, "timeout", datalist))
+    return response.json(make_response(0, "OK", datalist))
+
+
 @bp_gm_adaptor.route("/today_entrusts", methods=["POST"])
 async def bp_mock_get_today_entrusts(request):
     """查询今天委托情况，可传入需要查询的委托号码清单"""
@@ -362,28 +648,137 @@ async def bp_mock_get_today_entrusts(request):
     else:
         logger.info("today_entrusts: account->%s, query all entrusts", account_id)
 
-    result = await handler.wrapper_get_today_all_entrusts(account_id)
+    result = await handler.wrapper_get_today_all_entrusts(account_id, entrust_list)
     if result["status"] != 200:
         logger.info(f"today_entrusts result: {result['msg']}")
         return response.json(make_response(-1, result["msg"]))
 
     datalist = result["data"]
-    return_list = {}
-    if len(entrust_list) > 0:  # 取出用户需要的委托信息
-        for entrust_no in entrust_list:
-            if entrust_no in datalist:
-                return_list[entrust_no] = datalist[entrust_no]
-    else:
-        return_list = datalist
+    if not entrust_list:
+        # 查询全部委托时数据量较大，分块发送
+        logger.info("today_entrusts result: %d entrusts", len(datalist))
+        await _stream_json_response(request, make_response(0, "OK"), datalist)
+        return
 
-    if len(return_list) > 0:
-        for item in return_list.keys():
-            logger.info(f"today_entrusts result: {item}\n{return_list[item]}")
+    if len(datalist) > 0:
+        for item in datalist.keys():
+            logger.info(f"today_entrusts result: {item}\n{datalist[item]}")
     else:
-        logger.info(
-            "today_entrusts result: no results found, datalist: %d", len(datalist)
+        logger.info("today_entrusts result: no results found")
+    return response.json(make_response(0, "OK", datalist))
+
+
+async def _stream_json_response(
+    request, resp: dict, datalist: dict, chunk_size: int = 500
+):
+    """以流的方式返回make_response的结果，data字段的内容分块序列化和发送
+
+    发送每块数据之间让出事件循环，数据量大时不会长时间阻塞其它请求
+    """
+    stream = await request.respond(content_type="application/json")
+
+    head = json_dumps({"status": resp["status"], "msg": resp["msg"]})
+    await stream.send(head[:-1] + ',"data":{')
+
+    items = list(datalist.items())
+    for i in range(0, len(items), chunk_size):
+        chunk = ",".join(
+            f"{json_dumps(sid)}:{json_dumps(event)}"
+            for sid, event in items[i : i + chunk_size]
         )
-    return response.json(make_response(0, "OK", return_list))
+        if i > 0:
+            chunk = "," + chunk
+        await stream.send(chunk)
+
+    await stream.send("}}", end_stream=True)
+
+
+@bp_gm_adaptor.route("/metrics", methods=["GET"])
+async def bp_get_metrics(request):
+    """以Prometheus文本格式输出本进程的统计指标"""
+    return response.text(
+        metrics.render_metrics(), content_type="text/plain; version=0.0.4"
+    )
+
+
+@bp_gm_adaptor.route("/debug/trace/<sid>", methods=["GET"])
+async def bp_get_order_trace(request, sid: str):
+    """查询委托的处理过程，只包括本进程写入的委托。账户由Account-ID请求头或者
+    account_id参数指定
+    """
+    account_id = request.headers.get("Account-ID") or request.args.get("account_id")
+    if account_id is None or (not check_gm_account(account_id)):
+        return response.json(make_response(401, "invalid Account-ID"), 401)
+
+    trace = get_order_trace(account_id, sid)
+    if trace is None:
+        return response.json(make_response(1, "trace not found"))
+
+    return response.json(make_response(0, "OK", trace.toDict()))
+
+
+@bp_gm_adaptor.route("/debug/traces", methods=["GET"])
+async def bp_export_order_traces(request):
+    """以JSON lines格式导出全部委托的处理过程，可以用account_id参数指定账户"""
+    account_id = request.args.get("account_id")
+    traces = [
+        trace
+        for trace in list(order_traces.values())
+        if account_id is None or trace.account_id == account_id
+    ]
+
+    stream = await request.respond(content_type="application/x-ndjson")
+    for i in range(0, len(traces), 500):
+        await stream.send(
+            "".join(json_dumps(trace.toDict()) + "\n" for trace in traces[i : i + 500])
+        )
+    await stream.eof()
+
+
+@bp_gm_adaptor.route("/order_events", methods=["GET"])
+async def bp_order_events(request):
+    """以Server-Sent Events的方式推送委托的状态变化
+
+    账户由Account-ID请求头或者account_id参数指定。每个事件的id为"进程标识-递增的序号"，
+    data为TradeEvent.toDict()的数据，断线重连时通过Last-Event-ID请求头或者since参数指定
+    收到的最后一个事件id；中间的事件已经丢弃（或者重连到了另一个进程）时，先推送一个
+    reset事件，客户端需要重新查询/today_entrusts
+    """
+    account_id = request.headers.get("Account-ID") or request.args.get("account_id")
+    if account_id is None or (not check_gm_account(account_id)):
+        return response.json(make_response(401, "invalid Account-ID"), 401)
+
+    stream = get_order_event_stream(account_id)
+    if stream is None:
+        return response.json(make_response(-1, "order event stream not found"))
+
+    last_id = request.headers.get("Last-Event-ID") or request.args.get("since") or "0"
+    try:
+        seq = stream.parse_event_id(last_id)
+    except ValueError:
+        return response.json(make_response(400, "invalid event id"))
+
+    logger.info("order_events: account->%s, since->%d", account_id, seq)
+    resp = await request.respond(
+        content_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+    while True:
+        events, complete = stream.events_since(seq)
+        if not complete:
+            await resp.send(f"event: reset\ndata: {json_dumps({'seq': seq})}\n\n")
+            seq = 0
+        if events:
+            await resp.send(
+                "".join(
+                    f"id: {stream.epoch}-{event_seq}\nevent: order\n"
+                    f"data: {json_dumps(event)}\n\n"
+                    for event_seq, event in events
+                )
+            )
+            seq = events[-1][0]
+        elif not await stream.wait(seq, 15):
+            # 保持连接，避免被代理服务器断开
+            await resp.send(": keepalive\n\n")
 
 
 def initialize_blueprint(app: Sanic):
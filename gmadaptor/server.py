@@ -1,18 +1,28 @@
 # -*- coding: utf-8 -*-
 import logging
+import multiprocessing
+import multiprocessing.connection
 import os
 import sys
+import threading
+import time
 from logging.handlers import TimedRotatingFileHandler
 from os import path
 
 import cfg4py
 from cfg4py.config import Config
 
-from gmadaptor.gmclient.wrapper import gm_client_wrapper_start
-from gmadaptor.httpserver.server import server_start
+from gmadaptor.gmclient.wrapper import account_list, gm_client_wrapper_start
+from gmadaptor.httpserver.router import router_start
+from gmadaptor.httpserver.server import get_app, server_start
 
 logger = logging.getLogger(__name__)
 
+_initialized = False
+
+# 账户进程启动后不到这个秒数就退出时，等满这个时间再重新启动，避免反复重启
+SHARD_RESTART_DELAY = 5
+
 
 def get_config_dir():
     if cfg4py.envar in os.environ and os.environ[cfg4py.envar] == "DEV":
@@ -50,16 +60,22 @@ def init_log_path(log_dir):
     return 0
 
 
-def init_logger(filename: str, loglevel: int):
-    LOG_FORMAT = r"%(asctime)s %(levelname)s %(filename)s[line:%(lineno)d] %(message)s"
-    DATE_FORMAT = r"%Y-%m-%d  %H:%M:%S %a"
+LOG_FORMAT = r"%(asctime)s %(levelname)s %(filename)s[line:%(lineno)d] %(message)s"
+DATE_FORMAT = r"%Y-%m-%d  %H:%M:%S %a"
 
+
+def create_file_handler(filename: str, loglevel: int):
     fh = TimedRotatingFileHandler(
         filename, when="D", interval=1, backupCount=7, encoding="utf-8"
     )
     fh.setLevel(loglevel)
+    fh.setFormatter(logging.Formatter(fmt=LOG_FORMAT, datefmt=DATE_FORMAT))
+    return fh
+
+
+def init_logger(filename: str, loglevel: int):
+    fh = create_file_handler(filename, loglevel)
     formatter = logging.Formatter(fmt=LOG_FORMAT, datefmt=DATE_FORMAT)
-    fh.setFormatter(formatter)
 
     console = logging.StreamHandler(sys.stdout)
     console.setLevel(loglevel)
@@ -80,29 +96,172 @@ def ensure_folder_exists():
         _dir = os.path.expanduser(account["acct_input"])
         os.makedirs(_dir, exist_ok=True)
 
-def start():
-    current_dir = os.getcwd()
-    print("current dir:", current_dir)
+def get_log_file(log_name: str = None):
+    """主进程写server.log，worker和账户进程写server.<log_name>.log"""
+    log_dir = path.normpath(path.expanduser(cfg4py.get_instance().log_dir))
+    init_log_path(log_dir)
+
+    filename = f"server.{log_name}.log" if log_name else "server.log"
+    return path.normpath(path.join(log_dir, filename))
+
+
+def switch_log_file(log_name: str):
+    """fork的子进程继承了主进程的日志文件，换成自己的文件。多个进程写同一个文件时，
+    按天切换文件会互相覆盖（Windows上切换会失败）
+    """
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, TimedRotatingFileHandler):
+            root.removeHandler(handler)
+            handler.close()
+
+    loglevel = cfg4py.get_instance().log_level
+    root.addHandler(create_file_handler(get_log_file(log_name), loglevel))
+
+
+def init_env(log_name: str = None):
+    """读取配置，初始化日志。spawn方式启动的子进程需要重新初始化，fork的子进程直接继承，
+    只需要换成自己的日志文件
+
+    Args:
+        log_name (str, optional): 子进程的名字，日志写入server.<log_name>.log
+    """
+    global _initialized
+    if _initialized:
+        if log_name:
+            switch_log_file(log_name)
+        return
 
     init_config()
-    server_config = cfg4py.get_instance()
+    loglevel = cfg4py.get_instance().log_level
+    init_logger(get_log_file(log_name), loglevel)
+    _initialized = True
 
-    loglevel = server_config.log_level
-    log_dir = path.normpath(path.expanduser(server_config.log_dir))
-    init_log_path(log_dir)
 
-    logfile = path.normpath(path.join(log_dir, "server.log"))
-    init_logger(logfile, loglevel)
+def init_server(account_ids: list = None):
+    init_env()
 
     logger.info("launch gm client wrapper ...")
-    rc = gm_client_wrapper_start()
+    rc = gm_client_wrapper_start(account_ids)
     if rc != 0:
         logger.error("failed to launch gm client wrapper")
         os._exit(1)
 
+
+def create_app():
+    # 多进程模式下每个worker进程调用，spawn方式启动的进程需要重新初始化。
+    # SANIC_WORKER_NAME由sanic在worker进程中设置，主进程中没有
+    init_env(os.environ.get("SANIC_WORKER_NAME"))
+    if not account_list:
+        init_server()
+    return get_app()
+
+
+def run_account_shard(account_id: str, port: int):
+    """账户进程的入口，只加载一个账户，只接受主进程转发的请求"""
+    if hasattr(os, "setpgrp"):
+        # 不接收终端的Ctrl-C，由主进程在退出时结束，避免主进程停止前把账户进程当作
+        # 异常退出重新启动
+        os.setpgrp()
+    init_env(f"account-{account_id[:8]}")
+    init_server([account_id])
+
+    logger.info("launch http server of account %s, port %d", account_id, port)
+    server_start(port, host="127.0.0.1")
+
+
+def start_account_shards(port: int):
+    """每个账户启动一个进程，由这个进程监控账户的输出文件、维护委托状态索引和写入
+    文件单，主进程只按Account-ID转发请求。账户之间不再共用事件循环，一个账户解析
+    大文件时不影响其它账户
+    """
+    server_info = cfg4py.get_instance().server_info
+    if (getattr(server_info, "workers", None) or 1) > 1:
+        logger.warning("workers is ignored when shard_by_account is enabled")
+
+    ctx = multiprocessing.get_context("fork" if sys.platform == "linux" else "spawn")
+    shards = {}
+    processes = {}
+    for i, account in enumerate(cfg4py.get_instance().gm_info.accounts):
+        acct_id = account["acct_id"]
+        shard_port = port + 1 + i
+        processes[acct_id] = start_account_shard(ctx, acct_id, shard_port)
+        shards[acct_id] = f"http://127.0.0.1:{shard_port}"
+
+    # 重新启动时主进程已经在运行转发服务，fork的子进程会继承sanic的状态，只能spawn
+    stopping = threading.Event()
+    supervisor = threading.Thread(
+        target=supervise_account_shards,
+        args=(multiprocessing.get_context("spawn"), processes, stopping),
+        name="shard_supervisor",
+        daemon=True,
+    )
+    supervisor.start()
+
+    logger.info("launch request router ...")
+    try:
+        router_start(port, shards)
+    finally:
+        # 之后账户进程随主进程退出，不再重新启动
+        stopping.set()
+
+
+def start_account_shard(ctx, account_id: str, port: int):
+    process = ctx.Process(
+        target=run_account_shard,
+        args=(account_id, port),
+        name=f"gmadaptor-{account_id[:8]}",
+        daemon=True,
+    )
+    process.start()
+    logger.info("account process started: %s, pid %d", account_id, process.pid)
+    return process, port, time.monotonic()
+
+
+def supervise_account_shards(ctx, processes: dict, stopping: threading.Event):
+    """监控账户进程，进程退出时记录退出码，在原来的端口上重新启动
+
+    Args:
+        ctx: multiprocessing的启动方式
+        processes (dict): 账户 -> (账户进程, 端口, 启动时间)
+        stopping (threading.Event): 主进程正在退出
+    """
+    while not stopping.is_set():
+        sentinels = {p[0].sentinel: acct_id for acct_id, p in processes.items()}
+        for sentinel in multiprocessing.connection.wait(list(sentinels)):
+            acct_id = sentinels[sentinel]
+            process, port, started_at = processes[acct_id]
+            process.join()
+            if stopping.is_set():
+                return
+
+            logger.error(
+                "account process exited: %s, pid %d, exitcode %s",
+                acct_id,
+                process.pid,
+                process.exitcode,
+            )
+            delay = started_at + SHARD_RESTART_DELAY - time.monotonic()
+            if delay > 0 and stopping.wait(delay):
+                return
+            processes[acct_id] = start_account_shard(ctx, acct_id, port)
+
+
+def start():
+    current_dir = os.getcwd()
+    print("current dir:", current_dir)
+
+    init_env()
+    server_info = cfg4py.get_instance().server_info
+    if getattr(server_info, "shard_by_account", None):
+        start_account_shards(server_info.port)
+        return
+
+    init_server()
+
     logger.info("launch http server ...")
-    server_info = server_config.server_info
-    server_start(server_info.port)
+    workers = getattr(server_info, "workers", None) or 1
+    server_start(server_info.port, workers, create_app)
 
 
 if __name__ == "__main__":
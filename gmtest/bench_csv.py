@@ -0,0 +1,218 @@
+# CSV解析性能测试
+# 在临时目录中生成掘金格式的执行回报文件，对比逐行DictReader + strptime构建对象的方式，
+# 和按表头编译字段位置、缓存时间解析结果的方式；并对比记录对象使用__slots__前后
+# 每条记录占用的内存
+#
+# python -m gmtest.bench_csv [rows]
+import csv
+import datetime
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from gmadaptor.common.types import TradeEvent
+from gmadaptor.common.utils import math_round, safe_float, safe_int
+from gmadaptor.gmclient import csvdata
+from gmadaptor.gmclient.csvdata import (
+    GMCash,
+    GMExecReport,
+    GMOrderReport,
+    GMPosition,
+    csv_record_parser,
+)
+
+EXEC_REPORT_HEADER = (
+    "account_id,sid,scan_name,cl_ord_id,order_id,exec_id,symbol,order_type,"
+    "order_business(order_biz),ord_rej_reason(rej_reason),"
+    "ord_rej_reason_detail(rej_detail),exec_type,price,volume,created_at,recv_at\n"
+)
+
+
+def generate_exec_report(filename: str, rows: int):
+    start = datetime.datetime(2023, 4, 3, 9, 30)
+    with open(filename, "w", encoding="utf-8-sig", newline="") as f:
+        f.write(EXEC_REPORT_HEADER)
+        for i in range(rows):
+            # 每秒大约20笔成交
+            created_at = start + datetime.timedelta(microseconds=i * 50123)
+            recv_at = created_at + datetime.timedelta(microseconds=1234)
+            t1 = created_at.strftime("%Y-%m-%dT%H:%M:%S.%f+08:00")
+            t2 = recv_at.strftime("%Y-%m-%dT%H:%M:%S.%f+08:00")
+            f.write(
+                f"acct,sid{i // 3},scan,cl{i},oid{i // 3},exec{i},SZSE.000001,1,"
+                f"{1 + i % 2},0,,15,{10 + (i % 100) / 100:.2f},{100 * (1 + i % 5)},"
+                f"{t1},{t2}\n"
+            )
+
+
+def baseline_datetime_conversion(timestr: str):
+    # 改动前的csvdata.datetime_conversion
+    if timestr.find(".") != -1:
+        return datetime.datetime.strptime(timestr, "%Y-%m-%dT%H:%M:%S.%f+08:00")
+    else:
+        return datetime.datetime.strptime(timestr, "%Y-%m-%dT%H:%M:%S+08:00")
+
+
+class BaselineExecReport:
+    """改动前的GMExecReport，从DictReader的每一行dict构建"""
+
+    def __init__(self, dict_data):
+        self.sid = dict_data["sid"]
+        self.cl_ord_id = dict_data["cl_ord_id"]
+        self.order_id = dict_data["order_id"]
+        self.exec_id = dict_data["exec_id"]
+        self.symbol = dict_data["symbol"]
+        self.order_side = safe_int(dict_data["order_business(order_biz)"])
+        self.rej_reason = safe_int(dict_data["ord_rej_reason(rej_reason)"])
+        self.rej_detail = dict_data["ord_rej_reason_detail(rej_detail)"]
+        self.exec_type = safe_int(dict_data["exec_type"])
+        self.price = math_round(safe_float(dict_data["price"]), 2)
+        self.volume = safe_int(dict_data["volume"])
+        self.created_at = baseline_datetime_conversion(dict_data["created_at"])
+        self.recv_at = baseline_datetime_conversion(dict_data["recv_at"])
+
+
+def parse_with_dictreader(filename: str):
+    # 原来的解析方式：每行一个dict，时间字段每次调用strptime
+    with open(filename, "r", encoding="utf-8-sig") as csvfile:
+        return [BaselineExecReport(row) for row in csv.DictReader(csvfile)]
+
+
+def parse_with_schema(filename: str):
+    with open(filename, "r", encoding="utf-8-sig", newline="") as csvfile:
+        rows = csv.reader(csvfile)
+        parse = csv_record_parser(GMExecReport, next(rows))
+        return [parse(row) for row in rows if row]
+
+
+def record_values(report):
+    return tuple(getattr(report, name) for name in GMExecReport.__slots__)
+
+
+def timeit(func, *args):
+    t0 = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - t0, result
+
+
+def without_slots(cls):
+    # 复制出一个没有__slots__的同名类，即原来每个实例带__dict__的实现
+    attrs = {
+        name: value
+        for name, value in cls.__dict__.items()
+        if name != "__slots__" and name not in cls.__slots__
+    }
+    return type(cls.__name__, (), attrs)
+
+
+def bytes_per_record(factory, count: int):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    records = [factory() for _ in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    assert len(records) == count
+    return (after - before) / count
+
+
+def run_memory(count: int):
+    now = datetime.datetime.now()
+    created_at = "2023-04-03T09:30:00.123456+08:00"
+    order_values = (
+        f"sid,cl,oid,SZSE.000001,1,1,3,0,,10.50,100,100,{created_at},{created_at}"
+    ).split(",")
+    exec_values = (
+        f"sid,cl,oid,exec,SZSE.000001,1,0,,15,10.50,100,{created_at},{created_at}"
+    ).split(",")
+    cash = {
+        "account_id": "acct",
+        "market_value(market_val)": "100000.0",
+        "nav": "1000000.0",
+        "pnl": "100.0",
+        "fpnl": "50.0",
+        "frozen": "0",
+        "balance": "900000.0",
+        "available": "900000.0",
+        "order_frozen(ord_frozen)": "10.0",
+    }
+    position = {
+        "account_id": "acct",
+        "symbol": "SZSE.000001",
+        "side": "1",
+        "volume": "1000",
+        "volume_today(vol_today)": "100",
+        "vwap": "10.123",
+        "vwap_diluted(vwap_dild)": "10.2",
+        "market_value(market_val)": "10500.0",
+        "price": "10.5",
+        "fpnl": "300.0",
+        "available_now(avl_now)": "900",
+    }
+    event_args = (
+        "000001.XSHE",
+        10.5,
+        100,
+        1,
+        1,
+        now,
+        "sid",
+        3,
+        10.5,
+        100,
+        "oid",
+        5.0,
+        "",
+        now,
+    )
+
+    cases = [
+        (GMOrderReport, lambda cls: cls.from_values(order_values)),
+        (GMExecReport, lambda cls: cls.from_values(exec_values)),
+        (GMCash, lambda cls: cls(cash)),
+        (GMPosition, lambda cls: cls(position)),
+        (TradeEvent, lambda cls: cls(*event_args)),
+    ]
+
+    print(f"\nbytes per record ({count} records, including field values):")
+    for cls, build in cases:
+        legacy = without_slots(cls)
+        old_record, new_record = build(legacy), build(cls)
+        assert old_record.toDict() == new_record.toDict()
+
+        old_size = bytes_per_record(lambda: build(legacy), count)
+        new_size = bytes_per_record(lambda: build(cls), count)
+        print(
+            f"{cls.__name__:<14} __dict__: {old_size:7.1f}  __slots__: {new_size:7.1f}"
+            f"  saved: {1 - new_size / old_size:.0%}"
+        )
+
+
+def run(rows: int):
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, "execution_report.csv")
+        generate_exec_report(filename, rows)
+        print(f"execution_report.csv: {rows} rows, {os.path.getsize(filename)} bytes")
+
+        elapsed_old, reports_old = timeit(parse_with_dictreader, filename)
+        csvdata._seconds_conversion.cache_clear()
+        elapsed_new, reports_new = timeit(parse_with_schema, filename)
+
+    assert len(reports_old) == len(reports_new)
+    for old, new in zip(reports_old, reports_new):
+        assert record_values(old) == record_values(new), (old.exec_id, new.exec_id)
+
+    print(f"DictReader + strptime: {elapsed_old:.3f}s, {rows / elapsed_old:.0f} rows/s")
+    print(f"compiled schema:       {elapsed_new:.3f}s, {rows / elapsed_new:.0f} rows/s")
+    print(f"speedup: {elapsed_old / elapsed_new:.2f}x, parsed values identical")
+
+
+if __name__ == "__main__":
+    rows = 100000
+    if len(sys.argv) > 1:
+        rows = int(sys.argv[1])
+
+    run(rows)
+    run_memory(rows)
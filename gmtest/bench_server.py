@@ -0,0 +1,326 @@
+# 文件单服务的性能测试
+# 在临时目录中生成配置和掘金输出文件，启动模拟的掘金终端（gmtest.fake_gm）和适配器
+# 服务，在不同的当日委托数量下，测试/buy, /batch_sell, /cancel_entrusts, /today_entrusts
+# 的延迟（p50, p99）和每秒处理的委托数。全部在本机运行，不需要掘金终端。
+#
+# python -m gmtest.bench_server [--sizes 0,10000,100000] [--requests 200]
+#     [--concurrency 10] [--batch-size 10] [--ack-delay 5] [--fill-delay 20]
+#     [--exec-delay 0] [--partial-fills 1]
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+from gmadaptor.common.types import OrderSide, OrderStatus, OrderType
+from gmtest.fake_gm import prepare_output
+
+ACCOUNT_ID = "bench"
+ACCESS_TOKEN = "bench-token"
+
+CONFIG_TEMPLATE = """log_level: WARNING
+log_dir: "{root}/logs"
+server_info:
+    port: {port}
+    access_token: "{token}"
+gm_info:
+    fake: true
+    gm_output: "{root}/out"
+    trade_fees:
+        commission: 2.5
+        stamp_duty: 10.0
+        transfer_fee: 0.1
+        minimum_cost: 5.0
+    accounts:
+        - name: bench
+          acct_id: {account}
+          acct_input: "{root}/in"
+"""
+
+
+def serve(config_dir: str, port: int):
+    """在子进程中运行适配器服务"""
+    import cfg4py
+
+    from gmadaptor.gmclient.wrapper import gm_client_wrapper_start
+    from gmadaptor.httpserver.server import server_start
+
+    cfg4py.init(config_dir, False)
+    logging.basicConfig(level=logging.WARNING)
+    if gm_client_wrapper_start() != 0:
+        sys.exit(1)
+    server_start(port)
+
+
+def get_free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[int(round(q * (len(values) - 1)))]
+
+
+class LoadDriver:
+    def __init__(self, url: str, concurrency: int, timeout: float = 5):
+        self.url = url
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.headers = {"Authorization": ACCESS_TOKEN, "Account-ID": ACCOUNT_ID}
+        self.client = None
+
+    async def post(self, path: str, body: dict) -> dict:
+        r = await self.client.post(self.url + path, headers=self.headers, json=body)
+        return r.json()
+
+    async def run(self, requests: list, check):
+        """并发发送请求，返回每个请求的耗时、失败的请求数和总耗时
+
+        Args:
+            requests (list): [(path, body)]
+            check: 参数为(body, resp)，返回请求是否成功
+        """
+        latencies, errors = [], 0
+        pending = iter(requests)
+
+        async def worker():
+            nonlocal errors
+            for path, body in pending:
+                t0 = time.perf_counter()
+                try:
+                    resp = await self.post(path, body)
+                    ok = check(body, resp)
+                except (httpx.HTTPError, ValueError):
+                    ok = False
+                latencies.append(time.perf_counter() - t0)
+                if not ok:
+                    errors += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        return latencies, errors, time.perf_counter() - t0
+
+
+def buy_order(cid: str, code: str = "000001.XSHE", asynchronous: bool = False):
+    return {
+        "security": code,
+        "price": 10.5,
+        "volume": 100,
+        "cid": cid,
+        "timeout": 5,
+        "async": asynchronous,
+    }
+
+
+def check_buy(body: dict, resp: dict) -> bool:
+    return resp["status"] == 0 and resp["data"]["status"] == OrderStatus.ALL_TX
+
+
+def check_batch(body: dict, resp: dict) -> bool:
+    if resp["status"] != 0:
+        return False
+    data = resp["data"]
+    return all(
+        data.get(o["cid"], {}).get("status") == OrderStatus.ALL_TX
+        for o in body["sec_list"]
+    )
+
+
+def check_cancel(body: dict, resp: dict) -> bool:
+    if resp["status"] != 0:
+        return False
+    data = resp["data"]
+    return all(
+        data.get(sid, {}).get("status") == OrderStatus.CANCELED
+        for sid in body["entrust_no"]
+    )
+
+
+async def run_endpoints(driver: LoadDriver, args, day_rows: int) -> list:
+    results = []
+    n = args.requests
+
+    requests = [("buy", buy_order(uuid.uuid4().hex)) for _ in range(n)]
+    results.append(("/buy", n, *await driver.run(requests, check_buy)))
+
+    requests = []
+    for _ in range(n):
+        sec_list = [
+            {
+                "security": "000001.XSHE",
+                "price": 10.5,
+                "volume": 100,
+                "cid": uuid.uuid4().hex,
+                "order_side": OrderSide.SELL.value,
+                "order_type": OrderType.LIMIT.value,
+            }
+            for _ in range(args.batch_size)
+        ]
+        requests.append(("batch_sell", {"sec_list": sec_list, "timeout": 5}))
+    results.append(
+        ("/batch_sell", n * args.batch_size, *await driver.run(requests, check_batch))
+    )
+
+    # 018014只有响应没有成交，先异步提交，再逐个撤单
+    cids = [uuid.uuid4().hex for _ in range(n)]
+    await driver.run(
+        [("buy", buy_order(cid, "018014.XSHE", True)) for cid in cids],
+        lambda body, resp: True,
+    )
+    await asyncio.sleep(0.5)  # 等待委托的“已报”状态
+    requests = [
+        ("cancel_entrusts", {"entrust_no": [cid], "timeout": 5}) for cid in cids
+    ]
+    results.append(("/cancel_entrusts", n, *await driver.run(requests, check_cancel)))
+
+    # 全部委托：当天已有的day_rows个，加上测试中提交的委托
+    total = day_rows + n * (2 + args.batch_size)
+    queries = args.query_requests
+    requests = [("today_entrusts", {"entrust_no": []}) for _ in range(queries)]
+    results.append(
+        (
+            "/today_entrusts",
+            queries * total,
+            *await driver.run(
+                requests,
+                lambda body, resp: resp["status"] == 0 and len(resp["data"]) == total,
+            ),
+        )
+    )
+    return results
+
+
+def start_processes(root: str, port: int, args, day_rows: int):
+    for folder in ("in", "logs", "config"):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    with open(os.path.join(root, "config", "defaults.yaml"), "w") as f:
+        f.write(
+            CONFIG_TEMPLATE.format(
+                root=root.replace("\\", "/"),
+                port=port,
+                token=ACCESS_TOKEN,
+                account=ACCOUNT_ID,
+            )
+        )
+    output_dir = os.path.join(root, "out", ACCOUNT_ID)
+    prepare_output(output_dir, ACCOUNT_ID, day_rows)
+
+    log = open(os.path.join(root, "logs", "processes.log"), "w")
+    terminal = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gmtest.fake_gm",
+            os.path.join(root, "in"),
+            output_dir,
+            ACCOUNT_ID,
+            "--keep-output",
+            "--ack-delay",
+            str(args.ack_delay),
+            "--fill-delay",
+            str(args.fill_delay),
+            "--exec-delay",
+            str(args.exec_delay),
+            "--partial-fills",
+            str(args.partial_fills),
+        ],
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "gmtest.bench_server",
+            "--serve",
+            os.path.join(root, "config"),
+            "--port",
+            str(port),
+        ],
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    return [terminal, server], log
+
+
+def wait_server_ready(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            r = httpx.get(url, headers={"Authorization": ACCESS_TOKEN})
+            if r.status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server not ready")
+
+
+async def bench(url: str, args, day_rows: int):
+    driver = LoadDriver(url, args.concurrency)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        driver.client = client
+        return await run_endpoints(driver, args, day_rows)
+
+
+def run(args):
+    for day_rows in args.sizes:
+        with tempfile.TemporaryDirectory() as root:
+            port = get_free_port()
+            url = f"http://127.0.0.1:{port}/"
+            processes, log = start_processes(root, port, args, day_rows)
+            try:
+                wait_server_ready(url)
+                results = asyncio.run(bench(url, args, day_rows))
+            finally:
+                for process in processes:
+                    process.terminate()
+                    process.wait()
+                log.close()
+
+        print(f"\nday rows: {day_rows}, concurrency: {args.concurrency}")
+        print(
+            f"{'endpoint':<18}{'requests':>9}{'errors':>8}{'p50(ms)':>10}"
+            f"{'p99(ms)':>10}{'orders/s':>11}"
+        )
+        for endpoint, orders, latencies, errors, elapsed in results:
+            print(
+                f"{endpoint:<18}{len(latencies):>9}{errors:>8}"
+                f"{percentile(latencies, 0.5) * 1000:>10.2f}"
+                f"{percentile(latencies, 0.99) * 1000:>10.2f}"
+                f"{orders / elapsed:>11.0f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark of the file order server")
+    parser.add_argument(
+        "--sizes", default="0,10000,100000", help="orders already in today's files"
+    )
+    parser.add_argument("--requests", type=int, default=200, help="per endpoint")
+    parser.add_argument("--query-requests", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=10)
+    parser.add_argument("--ack-delay", type=float, default=5, help="ms")
+    parser.add_argument("--fill-delay", type=float, default=20, help="ms")
+    parser.add_argument("--exec-delay", type=float, default=0, help="ms")
+    parser.add_argument("--partial-fills", type=int, default=1)
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port)
+    else:
+        args.sizes = [int(size) for size in args.sizes.split(",")]
+        run(args)
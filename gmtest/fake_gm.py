@@ -0,0 +1,297 @@
+# 模拟的掘金终端
+# 监控账户输入目录中的文件单（YYYYMMDD.order.csv, YYYYMMDD.cancel_order.csv），按设定的
+# 延迟在输出目录中追加状态变化、委托状态和执行回报，用于在本机测试和评估适配器的性能。
+# 与东财的撮合配置规则一样，018014只有响应没有成交（挂单），000010全部拒绝，其它品种
+# 分partial_fills笔成交。真实的掘金终端中，执行回报比状态变化晚几秒输出，可以用
+# exec-delay模拟，默认同时输出（执行回报先写入）。
+#
+# python -m gmtest.fake_gm input_dir output_dir account_id [--ack-delay 5]
+#     [--fill-delay 20] [--exec-delay 0] [--partial-fills 1] [--day-rows 0]
+#     [--keep-output]
+import argparse
+import datetime
+import heapq
+import os
+import time
+
+ORDER_STATUS_HEADER = (
+    "account_id,sid,scan_name,cl_ord_id,order_id,symbol,order_type,"
+    "order_business(order_biz),status,ord_rej_reason(rej_reason),"
+    "ord_rej_reason_detail(rej_detail),price,volume,filled_volume(filled_vol),"
+    "created_at,updated_at,sent_at,recv_at\n"
+)
+EXEC_REPORT_HEADER = (
+    "account_id,sid,scan_name,cl_ord_id,order_id,exec_id,symbol,order_type,"
+    "order_business(order_biz),ord_rej_reason(rej_reason),"
+    "ord_rej_reason_detail(rej_detail),exec_type,price,volume,created_at,recv_at\n"
+)
+CASH_HEADER = (
+    "account_id,account_name,currency,nav,pnl,fpnl,frozen,order_frozen(ord_frozen),"
+    "available,balance,market_value(market_val),created_at,updated_at,recv_at\n"
+)
+POSITION_HEADER = (
+    "account_id,account_name,symbol,side,volume,volume_today(vol_today),vwap,"
+    "vwap_diluted(vwap_dild),market_value(market_val),price,fpnl,"
+    "available_now(avl_now),created_at,updated_at,recv_at\n"
+)
+
+# 委托状态
+STATUS_NEW = 1  # 已报
+STATUS_PARTIAL = 2  # 部分成交
+STATUS_FILLED = 3  # 已成
+STATUS_CANCELED = 5  # 已撤
+STATUS_REJECTED = 8  # 已拒
+
+# 每次循环合并写入输出文件的顺序
+OUTPUT_FILES = ("execution_report.csv", "order_status_change.csv", "order_status.csv")
+
+PENDING_SYMBOLS = ("SZSE.018014",)
+REJECTED_SYMBOLS = ("SZSE.000010",)
+
+
+def format_time(t: datetime.datetime) -> str:
+    return t.strftime("%Y-%m-%dT%H:%M:%S.%f+08:00")
+
+
+class Order:
+    def __init__(self, account_id: str, row: list):
+        self.account_id = account_id
+        self.sid = row[0]
+        self.symbol = row[2]
+        self.volume = int(row[3])
+        self.order_type = row[4]
+        self.order_biz = row[5]
+        self.price = float(row[6] or 0) or 10.0  # 市价委托以10元成交
+        self.filled = 0
+        self.status = 0
+        self.created_at = format_time(datetime.datetime.now())
+
+    def status_row(self, rej_reason: int = 0, rej_detail: str = "") -> str:
+        now = format_time(datetime.datetime.now())
+        return (
+            f"{self.account_id},{self.sid},fake,cl{self.sid},oid{self.sid},"
+            f"{self.symbol},{self.order_type},{self.order_biz},{self.status},"
+            f"{rej_reason},{rej_detail},{self.price},{self.volume},{self.filled},"
+            f"{self.created_at},{now},{self.created_at},{now}\n"
+        )
+
+    def exec_row(self, exec_id: str, volume: int) -> str:
+        now = format_time(datetime.datetime.now())
+        return (
+            f"{self.account_id},{self.sid},fake,cl{self.sid},oid{self.sid},{exec_id},"
+            f"{self.symbol},{self.order_type},{self.order_biz},0,,15,{self.price},"
+            f"{volume},{now},{now}\n"
+        )
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (STATUS_FILLED, STATUS_CANCELED, STATUS_REJECTED)
+
+
+class InputTail:
+    """增量读取文件单，只返回完整的行"""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.offset = 0
+
+    def read_rows(self) -> list:
+        try:
+            with open(self.filename, "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return []
+
+        end = data.rfind(b"\n")
+        if end == -1:
+            return []
+        data = data[: end + 1]
+        header = self.offset == 0
+        self.offset += len(data)
+
+        lines = data.decode("utf-8-sig").splitlines()
+        if header:
+            lines = lines[1:]
+        return [line.split(",") for line in lines if line]
+
+
+class FakeGMTerminal:
+    def __init__(
+        self,
+        input_dir: str,
+        output_dir: str,
+        account_id: str,
+        ack_delay: float = 0.005,
+        fill_delay: float = 0.02,
+        partial_fills: int = 1,
+        exec_delay: float = 0,
+    ):
+        self.output_dir = output_dir
+        self.account_id = account_id
+        self.ack_delay = ack_delay
+        self.fill_delay = fill_delay
+        self.partial_fills = max(partial_fills, 1)
+        self.exec_delay = exec_delay
+
+        today = datetime.date.today().strftime("%Y%m%d")
+        self._orders_input = InputTail(os.path.join(input_dir, f"{today}.order.csv"))
+        self._cancels_input = InputTail(
+            os.path.join(input_dir, f"{today}.cancel_order.csv")
+        )
+        self._orders = {}
+        self._schedule = []  # (时间, 序号, 处理函数, 参数)
+        self._seq = 0
+        self._output = {}  # 文件名 -> [数据行]，每次循环按OUTPUT_FILES的顺序写入
+
+    def _at(self, delay: float, func, *args):
+        self._seq += 1
+        heapq.heappush(
+            self._schedule, (time.monotonic() + delay, self._seq, func, args)
+        )
+
+    def _append(self, filename: str, line: str):
+        self._output.setdefault(filename, []).append(line)
+
+    def _append_status(self, order: Order, rej_reason: int = 0, rej_detail: str = ""):
+        line = order.status_row(rej_reason, rej_detail)
+        self._append("order_status_change.csv", line)
+        if order.status == STATUS_NEW or order.finished:
+            self._append("order_status.csv", line)
+
+    def _new_order(self, row: list):
+        order = Order(self.account_id, row)
+        self._orders[order.sid] = order
+        self._at(self.ack_delay, self._ack, order)
+
+    def _ack(self, order: Order):
+        if order.symbol in REJECTED_SYMBOLS:
+            order.status = STATUS_REJECTED
+            self._append_status(order, 1, "rejected by fake terminal")
+            return
+
+        order.status = STATUS_NEW
+        self._append_status(order)
+        if order.symbol in PENDING_SYMBOLS:
+            return
+
+        step = self.fill_delay / self.partial_fills
+        for i in range(self.partial_fills):
+            self._at(step * (i + 1), self._fill, order, i)
+
+    def _fill(self, order: Order, i: int):
+        if order.finished:  # 已撤
+            return
+
+        lot = order.volume // self.partial_fills
+        if i == self.partial_fills - 1:
+            lot = order.volume - order.filled
+        order.filled += lot
+        exec_row = order.exec_row(f"x{order.sid}-{i}", lot)
+        if self.exec_delay > 0:
+            self._at(self.exec_delay, self._append, "execution_report.csv", exec_row)
+        else:
+            self._append("execution_report.csv", exec_row)
+
+        if order.filled >= order.volume:
+            order.status = STATUS_FILLED
+        else:
+            order.status = STATUS_PARTIAL
+        self._append_status(order)
+
+    def _cancel(self, row: list):
+        order = self._orders.get(row[0])
+        if order is None or order.finished:  # 撤单被拒绝，状态不变
+            return
+
+        order.status = STATUS_CANCELED
+        self._append_status(order)
+
+    def _flush(self):
+        for filename in OUTPUT_FILES:
+            lines = self._output.pop(filename, None)
+            if lines:
+                filename = os.path.join(self.output_dir, filename)
+                with open(filename, "a", encoding="utf-8") as f:
+                    f.write("".join(lines))
+
+    def run_once(self):
+        for row in self._orders_input.read_rows():
+            self._new_order(row)
+        for row in self._cancels_input.read_rows():
+            self._at(self.ack_delay, self._cancel, row)
+
+        now = time.monotonic()
+        while self._schedule and self._schedule[0][0] <= now:
+            _, _, func, args = heapq.heappop(self._schedule)
+            func(*args)
+        self._flush()
+
+    def run(self, interval: float = 0.002):
+        while True:
+            self.run_once()
+            time.sleep(interval)
+
+
+def prepare_output(output_dir: str, account_id: str, day_rows: int = 0):
+    """生成空的输出文件，以及当天已经执行完毕的day_rows个委托"""
+    os.makedirs(output_dir, exist_ok=True)
+    now = format_time(datetime.datetime.now())
+
+    status_lines, exec_lines = [], []
+    for i in range(day_rows):
+        row = [f"day{i}", account_id, "SZSE.000001", "100", "1", str(1 + i % 2), "10.5"]
+        order = Order(account_id, row)
+        order.status = STATUS_NEW
+        status_lines.append(order.status_row())
+        order.status, order.filled = STATUS_FILLED, order.volume
+        status_lines.append(order.status_row())
+        exec_lines.append(order.exec_row(f"xday{i}", order.volume))
+
+    files = {
+        "order_status_change.csv": ORDER_STATUS_HEADER + "".join(status_lines),
+        "order_status.csv": ORDER_STATUS_HEADER + "".join(status_lines[1::2]),
+        "execution_report.csv": EXEC_REPORT_HEADER + "".join(exec_lines),
+        "cash.csv": CASH_HEADER
+        + f"{account_id},fake,CNY,1000000,0,0,0,0,1000000,1000000,0,{now},{now},{now}\n",
+        "position.csv": POSITION_HEADER
+        + f"{account_id},fake,SZSE.000001,1,100000,0,10.5,10.5,1050000,10.5,0,100000,"
+        f"{now},{now},{now}\n",
+    }
+    for filename, content in files.items():
+        with open(os.path.join(output_dir, filename), "w", encoding="utf-8-sig") as f:
+            f.write(content)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="fake GM terminal for file orders")
+    parser.add_argument("input_dir", help="acct_input of the account")
+    parser.add_argument("output_dir", help="gm_output/account_id")
+    parser.add_argument("account_id")
+    parser.add_argument("--ack-delay", type=float, default=5, help="ms")
+    parser.add_argument("--fill-delay", type=float, default=20, help="ms")
+    parser.add_argument("--exec-delay", type=float, default=0, help="ms")
+    parser.add_argument("--partial-fills", type=int, default=1)
+    parser.add_argument(
+        "--day-rows", type=int, default=0, help="orders already finished today"
+    )
+    parser.add_argument(
+        "--keep-output", action="store_true", help="do not regenerate output files"
+    )
+    args = parser.parse_args()
+
+    if not args.keep_output:
+        prepare_output(args.output_dir, args.account_id, args.day_rows)
+    terminal = FakeGMTerminal(
+        args.input_dir,
+        args.output_dir,
+        args.account_id,
+        args.ack_delay / 1000,
+        args.fill_delay / 1000,
+        args.partial_fills,
+        args.exec_delay / 1000,
+    )
+    try:
+        terminal.run()
+    except KeyboardInterrupt:
+        pass